@@ -9,13 +9,20 @@ const getEndpoint = (path: string) =>
 
 export interface DefectCandidate {
   label: string;
-  score: number;
+  score: number | null; // null when answered from a confirmed example
+  vector_score?: number;
 }
 
 export interface TaxonomyResponse {
   path_list: string[];
   full_path_str: string;
   defect_candidates: DefectCandidate[]; 
+  from_memory?: boolean;
+  memory_similarity?: number | null;
+  taxonomy_version?: string;
+  unreranked?: boolean;
+  path_confidence?: number | null;
+  needs_review?: boolean;
 }
 
 // 1. Define the type for the request body payload
@@ -29,7 +36,15 @@ const taxonomyAPI = {
   getTree(): Promise<any> {
     const url = getEndpoint("tree");
     return fetch(url, { method: "GET" })
-      .then(parseJSON)
+      .then((response) => {
+        if (!response.ok) {
+          // 503 while the server is still building its indexes; the caller retries
+          const error: any = new Error(`Tree Fetch failed with status ${response.status}`);
+          error.retryAfter = Number(response.headers.get("Retry-After")) || 5;
+          throw error;
+        }
+        return parseJSON(response);
+      })
       .catch((error) => {
         console.error("Tree Fetch Error:", error);
         throw error;
@@ -61,6 +76,24 @@ const taxonomyAPI = {
         throw error;
       });
   },
+
+  // Store an inspector-confirmed remark -> (path, defect) pair
+  sendFeedback(remark: string, fullPathStr: string, defect: string): Promise<any> {
+    const url = getEndpoint("feedback");
+    const options: RequestInit = {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ remark, full_path_str: fullPathStr, defect }),
+      credentials: "include",
+    };
+
+    return fetch(url, options)
+      .then(parseJSON)
+      .catch((error) => {
+        console.error("Feedback API Error:", error);
+        throw error;
+      });
+  },
 };
 
 export { taxonomyAPI };
\ No newline at end of file
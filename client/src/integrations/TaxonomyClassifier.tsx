@@ -13,6 +13,8 @@ export default function TaxonomyClassifier() {
   const [selectedPath, setSelectedPath] = useState<string[]>([]);
   const [selectedDefectType, setSelectedDefectType] = useState<string>("");
   const [aiDefectCandidates, setAiDefectCandidates] = useState<DefectCandidate[]>([]);
+  // What the AI proposed; feedback is only sent when the inspector corrected or confirmed it
+  const [aiResult, setAiResult] = useState<{ path: string; defect: string } | null>(null);
   
   const [treeData, setTreeData] = useState<any>({});
   const [isTreeLoading, setIsTreeLoading] = useState(true);
@@ -20,19 +22,26 @@ export default function TaxonomyClassifier() {
   // Track which button currently shows "Copied!"
   const [copiedId, setCopiedId] = useState<string | null>(null);
 
-  // 1. Load Tree
+  // 1. Load Tree (retried until the server has finished loading it)
   useEffect(() => {
+    let cancelled = false;
+    let retryTimer: ReturnType<typeof setTimeout> | undefined;
     const loadTree = async () => {
       try {
         const data = await taxonomyAPI.getTree();
+        if (cancelled) return;
         setTreeData(data);
-      } catch (e) {
-        console.error(e);
-      } finally {
         setIsTreeLoading(false);
+      } catch (e: any) {
+        if (cancelled) return;
+        retryTimer = setTimeout(loadTree, (e?.retryAfter ?? 5) * 1000);
       }
     };
     loadTree();
+    return () => {
+      cancelled = true;
+      clearTimeout(retryTimer);
+    };
   }, []);
 
   // 2. Derive Data
@@ -80,10 +89,12 @@ export default function TaxonomyClassifier() {
     
     try {
       const data = await taxonomyAPI.analyze(remark, constraintPath); 
+      const topDefect = data.defect_candidates.length > 0 ? data.defect_candidates[0].label : "";
       setSelectedPath(data.path_list);
       setAiDefectCandidates(data.defect_candidates);
-      if (data.defect_candidates.length > 0) {
-        setSelectedDefectType(data.defect_candidates[0].label);
+      setAiResult({ path: data.full_path_str, defect: topDefect });
+      if (topDefect) {
+        setSelectedDefectType(topDefect);
       }
     } catch (e) {
       console.error(e);
@@ -112,10 +123,22 @@ export default function TaxonomyClassifier() {
     setSelectedPath(newPath);
   };
 
-  const handleNextRemark = () => {
+  // True if the inspector changed the path or defect the AI proposed (or classified without the AI)
+  const isCorrected = () =>
+    !aiResult || aiResult.path !== selectedPath.join(" > ") || aiResult.defect !== selectedDefectType;
+
+  const handleNextRemark = (confirmed: boolean = false) => {
+    // Remember corrected or explicitly confirmed mappings so near-duplicates skip the AI round-trip.
+    // Unreviewed AI output is not stored; it would come back as trusted memory.
+    if ((confirmed || isCorrected()) && remark.trim() && selectedPath.length > 0 && selectedDefectType) {
+      taxonomyAPI
+        .sendFeedback(remark, selectedPath.join(" > "), selectedDefectType)
+        .catch(() => {});
+    }
     setRemark("");
     setSelectedPath([]);
     setAiDefectCandidates([]);
+    setAiResult(null);
     setSelectedDefectType("");
     setCopiedId(null);
     window.scrollTo({ top: 0, behavior: 'smooth' });
@@ -325,7 +348,7 @@ export default function TaxonomyClassifier() {
                                             <optgroup label="AI Recommendation">
                                                 {aiDefectCandidates.map((cand) => (
                                                     <option key={cand.label} value={cand.label}>
-                                                        {cand.label} ({Math.round(cand.score * 100)}%)
+                                                        {cand.score != null ? `${cand.label} (${Math.round(cand.score * 100)}%)` : cand.label}
                                                     </option>
                                                 ))}
                                             </optgroup>
@@ -396,9 +419,22 @@ export default function TaxonomyClassifier() {
                 )}
 
                 <div className="flex-1"></div>
+
+                <button
+                    onClick={() => handleNextRemark(true)}
+                    disabled={!remark.trim() || selectedPath.length === 0 || !selectedDefectType}
+                    title="Store this result as correct, then continue"
+                    className={`w-full px-4 py-3 rounded-lg font-medium border flex items-center justify-center gap-2
+                        ${!remark.trim() || selectedPath.length === 0 || !selectedDefectType
+                            ? 'bg-slate-50 border-slate-200 text-slate-300 cursor-not-allowed'
+                            : 'bg-white border-slate-200 text-slate-700 hover:border-black'}`}
+                >
+                    <CheckCircle2 className="w-4 h-4" />
+                    <span>Confirm &amp; Next</span>
+                </button>
                 
                 <button 
-                    onClick={handleNextRemark} 
+                    onClick={() => handleNextRemark()} 
                     className="w-full bg-black hover:bg-gray-800 text-white px-4 py-3 rounded-lg font-medium shadow-sm flex items-center justify-center gap-2 transition-transform active:scale-95 mt-auto"
                 >
                     <span>Next Remark</span>
@@ -0,0 +1,276 @@
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+
+from server.utils.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Finished (GPT-reranked) analyses by (normalized remark, constraint, taxonomy version).
+# Filled by every fully reranked run and warmed from the history on startup.
+ANALYSIS_RESULTS = LRUCache(max_entries=4096)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    request_id TEXT,
+    remark TEXT NOT NULL,
+    remark_key TEXT NOT NULL,
+    constraint_path TEXT NOT NULL DEFAULT '',
+    taxonomy_version TEXT NOT NULL,
+    source TEXT NOT NULL,
+    full_path_str TEXT,
+    defect TEXT,
+    candidates TEXT,
+    path_confidence REAL,
+    unreranked INTEGER NOT NULL,
+    needs_review INTEGER NOT NULL,
+    timings TEXT,
+    response TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_created ON analyses (created_at);
+CREATE INDEX IF NOT EXISTS idx_analyses_key ON analyses (taxonomy_version, remark_key, constraint_path);
+CREATE TABLE IF NOT EXISTS query_embeddings (
+    provider TEXT NOT NULL,
+    text TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (provider, text)
+);
+"""
+
+_INSERT_ANALYSIS = """
+INSERT INTO analyses (created_at, request_id, remark, remark_key, constraint_path, taxonomy_version, source,
+                      full_path_str, defect, candidates, path_confidence, unreranked, needs_review, timings, response)
+VALUES (:created_at, :request_id, :remark, :remark_key, :constraint_path, :taxonomy_version, :source,
+        :full_path_str, :defect, :candidates, :path_confidence, :unreranked, :needs_review, :timings, :response)
+"""
+
+# Columns returned by query()/export; `response` stays internal (it is only used for warming)
+EXPORT_COLUMNS = [
+    "id", "created_at", "request_id", "remark", "constraint_path", "taxonomy_version", "source",
+    "full_path_str", "defect", "candidates", "path_confidence", "unreranked", "needs_review", "timings",
+]
+
+_STOP = object()
+
+
+class AnalysisStore:
+    """
+    History of /api/analyze results in a local SQLite database (WAL mode).
+
+    record() only enqueues; a writer thread inserts in batches of up to
+    `batch_size` rows or every `flush_interval` seconds, so the request path
+    never waits on disk. If the queue is full, records are dropped and counted.
+    Reads open their own connection; WAL lets them run alongside the writer.
+
+    Retention: the writer also deletes analyses and query embeddings beyond
+    `max_rows` or older than `max_age` seconds (0 = no limit), at most once
+    per `prune_interval`. Freed pages are reused, the file does not shrink.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 200, flush_interval: float = 1.0, max_pending: int = 10000,
+                 max_rows: int = 0, max_age: float = 0, prune_interval: float = 60.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self.dropped = 0
+        self.pruned = 0
+
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name="analysis-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False: streamed exports are iterated from the server's thread pool
+        conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Writes ---
+
+    def record(self, row: Dict[str, Any], embeddings: List[Tuple[str, str, np.ndarray]] = ()):
+        """
+        Queues one analysis row (see _INSERT_ANALYSIS for the keys) plus the
+        (provider, text, vector) query embeddings it used. Never blocks.
+        """
+        try:
+            self._queue.put_nowait((row, embeddings))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        conn = self._connect()
+        self._prune(conn)
+        last_prune = time.monotonic()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            flush_at = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, flush_at - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write_batch(conn, batch)
+            if time.monotonic() - last_prune >= self.prune_interval:
+                self._prune(conn)
+                last_prune = time.monotonic()
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch):
+        now = time.time()
+        embeddings = [
+            (provider, text, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for _, embs in batch for provider, text, vector in embs
+        ]
+        try:
+            with conn:
+                conn.executemany(_INSERT_ANALYSIS, [row for row, _ in batch])
+                # A re-used embedding only gets its timestamp refreshed, so retention keeps it
+                conn.executemany(
+                    "INSERT INTO query_embeddings (provider, text, vector, created_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (provider, text) DO UPDATE SET created_at = excluded.created_at",
+                    embeddings,
+                )
+            self.written += len(batch)
+        except sqlite3.Error as e:
+            logger.error("Analysis store write failed (%d rows lost): %s", len(batch), e)
+
+    def _prune(self, conn: sqlite3.Connection):
+        """Applies the retention limits (runs on the writer thread)."""
+        if not self.max_rows and not self.max_age:
+            return
+        try:
+            deleted = 0
+            with conn:
+                if self.max_age:
+                    cutoff = time.time() - self.max_age
+                    deleted += conn.execute("DELETE FROM analyses WHERE created_at < ?", (cutoff,)).rowcount
+                    deleted += conn.execute("DELETE FROM query_embeddings WHERE created_at < ?", (cutoff,)).rowcount
+                if self.max_rows:
+                    # Keep the newest max_rows of each table
+                    deleted += conn.execute(
+                        "DELETE FROM analyses WHERE id IN (SELECT id FROM analyses ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                        (self.max_rows,),
+                    ).rowcount
+                    deleted += conn.execute(
+                        "DELETE FROM query_embeddings WHERE rowid IN"
+                        " (SELECT rowid FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_rows,),
+                    ).rowcount
+            if deleted:
+                self.pruned += deleted
+                logger.info("Analysis store: pruned %d rows past the retention limits.", deleted)
+        except sqlite3.Error as e:
+            logger.error("Analysis store prune failed: %s", e)
+
+    def close(self, timeout: float = 10.0):
+        """Flushes what is queued and stops the writer."""
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
+
+    # --- Reads ---
+
+    def warm(self, provider: Optional[str], taxonomy_version: Optional[str],
+             embedding_cache: LRUCache, result_cache: LRUCache) -> Dict[str, int]:
+        """
+        Loads the most recent query embeddings for `provider` and the most recent
+        fully reranked results for `taxonomy_version` into the in-memory caches.
+        """
+        warmed = {"embeddings": 0, "results": 0}
+        conn = self._connect()
+        try:
+            if provider:
+                rows = conn.execute(
+                    "SELECT text, vector FROM query_embeddings WHERE provider = ? ORDER BY created_at DESC LIMIT ?",
+                    (provider, embedding_cache.max_entries),
+                ).fetchall()
+                # Oldest first, so the newest end up most recently used
+                for text, blob in reversed(rows):
+                    embedding_cache.put((provider, text), np.frombuffer(blob, dtype=np.float32))
+                warmed["embeddings"] = len(rows)
+
+            if taxonomy_version:
+                rows = conn.execute(
+                    "SELECT remark_key, constraint_path, response FROM analyses"
+                    " WHERE taxonomy_version = ? AND source = 'computed' AND unreranked = 0 AND full_path_str != ''"
+                    " ORDER BY id DESC LIMIT ?",
+                    (taxonomy_version, result_cache.max_entries),
+                ).fetchall()
+                for remark_key, constraint_path, response in reversed(rows):
+                    result_cache.put((remark_key, constraint_path, taxonomy_version), json.loads(response))
+                warmed["results"] = len(rows)
+        finally:
+            conn.close()
+        return warmed
+
+    def _where(self, filters: Dict[str, Any]) -> Tuple[str, list]:
+        clauses, params = [], []
+        if filters.get("since") is not None:
+            clauses.append("created_at >= ?")
+            params.append(filters["since"])
+        if filters.get("until") is not None:
+            clauses.append("created_at < ?")
+            params.append(filters["until"])
+        if filters.get("taxonomy_version"):
+            clauses.append("taxonomy_version = ?")
+            params.append(filters["taxonomy_version"])
+        if filters.get("path_prefix"):
+            clauses.append("full_path_str LIKE ? ESCAPE '\\'")
+            prefix = filters["path_prefix"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"{prefix}%")
+        if filters.get("defect"):
+            clauses.append("defect = ?")
+            params.append(filters["defect"])
+        if filters.get("needs_review") is not None:
+            clauses.append("needs_review = ?")
+            params.append(int(filters["needs_review"]))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def iter_rows(self, filters: Dict[str, Any], limit: Optional[int] = None, offset: int = 0) -> Iterator[Dict[str, Any]]:
+        """Matching rows, newest first, with JSON columns decoded."""
+        where, params = self._where(filters)
+        sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM analyses{where} ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        conn = self._connect()
+        try:
+            for values in conn.execute(sql, params):
+                row = dict(zip(EXPORT_COLUMNS, values))
+                row["candidates"] = json.loads(row["candidates"]) if row["candidates"] else []
+                row["timings"] = json.loads(row["timings"]) if row["timings"] else {}
+                row["unreranked"] = bool(row["unreranked"])
+                row["needs_review"] = bool(row["needs_review"])
+                yield row
+        finally:
+            conn.close()
+
+    def query(self, filters: Dict[str, Any], limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        return list(self.iter_rows(filters, limit, offset))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"written": self.written, "pending": self._queue.qsize(), "dropped": self.dropped, "pruned": self.pruned}
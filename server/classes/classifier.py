@@ -1,9 +1,20 @@
+import logging
 import os
-import json
 import pickle
 import numpy as np
-import openai
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Optional
+
+from server.classes.taxonomy_model import TaxonomyModel, lexical_tokens
+from server.classes.embedding_provider import get_embedding_provider
+from server.classes.rerank_prompt import (
+    MAX_ANSWER_TOKENS, render_candidate_tree, parse_candidate_number, logprob_kwargs, candidate_probabilities
+)
+from server.utils.admission import ADMISSION, Overloaded
+from server.utils.hedging import Deadline, DeadlineExceeded, hedged_call
+from server.utils.circuit_breaker import CircuitOpen
+from server.utils.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
 
 # --- CONFIGURATION ---
 AZURE_CONFIG = {
@@ -15,310 +26,345 @@ AZURE_CONFIG = {
 }
 
 # Ensure environment variables are set externally for security in production
-os.environ["AZURE_TENANT_ID"] = os.getenv("AZURE_TENANT_ID") 
+os.environ["AZURE_TENANT_ID"] = os.getenv("AZURE_TENANT_ID")
+
+# Query embeddings by (provider key, text). Shared across taxonomy reloads; also the
+# fallback when the embedding circuit is open and the remark was seen before.
+QUERY_EMBEDDINGS = LRUCache(max_entries=4096)
+
+# Classification results are node IDs (int) on success, or one of these status strings
+STATUS_RESULTS = ["NONE", "UNCLASSIFIED", "ERROR_EMBED", "ERROR_GPT", "ERROR_NO_INDEX", "ERROR_NO_PATHS", "ERROR_NO_DEFECT_PATHS"]
 
 class VariableDepthClassifier:
-    def __init__(self, tree_path, cache_path):
+    def __init__(self, tree_path, cache_path, tree_data: Optional[Dict] = None):
         # Initialize Azure Client
+        # Imported here so loading this module (e.g. by the routes) stays off the startup critical path
+        import openai
         self.client = openai.AzureOpenAI(
             api_key=AZURE_CONFIG["api_key"],
             api_version=AZURE_CONFIG["api_version"],
-            azure_endpoint=AZURE_CONFIG["azure_endpoint"]
+            azure_endpoint=AZURE_CONFIG["azure_endpoint"],
+            # No SDK-internal retries: admission control and the circuit breaker must see every 429/5xx
+            max_retries=0
         )
-        
-        # Initialize the map for path -> defects
-        self.defects_map: Dict[str, List[str]] = {} 
-        
-        # 1. Load & Flatten Tree
-        if not os.path.exists(tree_path):
-            print(f"ERROR: {tree_path} not found. Classifier cannot start.")
-            self.paths = []
+        # Azure or local CPU model (EMBEDDING_PROVIDER); each has its own index cache
+        self.embedder = get_embedding_provider(self.client, AZURE_CONFIG["deployment_embed"])
+
+        # 1. Load Tree into the compact ID model (from the already parsed tree if the caller has it)
+        if tree_data is None and not os.path.exists(tree_path):
+            logger.error("%s not found. Classifier cannot start.", tree_path)
+            self.taxonomy = TaxonomyModel({})
             self.vectors = None
+            self.defect_vectors = None
             return
 
-        # Populates self.paths AND self.defects_map
-        self.paths = self._flatten_tree_all_levels(tree_path)
-        print(f"Tree loaded: {len(self.paths)} categories.")
-        
-        # 2. Load or Build Vectors (NumPy Matrix)
-        self.vectors = self._load_or_build_vectors(self.paths, cache_path)
+        self.taxonomy = TaxonomyModel(tree_data) if tree_data is not None else TaxonomyModel.from_json_file(tree_path)
+        logger.info("Tree loaded: %d categories.", len(self.taxonomy))
+
+        # 2. Load or Build Vectors (NumPy Matrix, row i = node ID i)
+        self.vectors = self._load_or_build_vectors(self.embedder.cache_path(cache_path))
 
-    def _flatten_tree_all_levels(self, path) -> List[str]:
+        # Contiguous copy of the rows that can be returned (nodes with defects)
+        self.defect_vectors = np.ascontiguousarray(self.vectors[self.taxonomy.defect_node_ids])
+
+    def _load_or_build_vectors(self, cache_path) -> np.ndarray:
         """
-        Parses the nested JSON tree into a flat list of strings (paths).
-        Also populates self.defects_map with the '__defects__' lists.
+        Loads vectors from pickle, embedding only paths missing from the cache
+        (so a tree update re-embeds just the changed nodes), and saves.
         """
-        with open(path, 'r', encoding='utf-8') as f:
-            tree = json.load(f)
-        
-        flat_paths = set()
-        
-        def recurse(node, current_path_str):
-            # 1. Check for Defects at this level
-            if isinstance(node, dict) and "__defects__" in node:
-                # Store the defects for this specific path
-                self.defects_map[current_path_str] = node["__defects__"]
-            
-            # 2. Add path to set (if not empty root)
-            if current_path_str:
-                flat_paths.add(current_path_str)
-
-            # 3. Recurse children
-            if isinstance(node, dict):
-                for key, child_node in node.items():
-                    if key in ["__defects__", "__spass_code__"]:
-                        continue
-                        
-                    new_path = f"{current_path_str} > {key}" if current_path_str else key
-                    recurse(child_node, new_path)
-
-        recurse(tree, "")
-        return sorted(list(flat_paths))
-
-    def _load_or_build_vectors(self, paths, cache_path) -> np.ndarray:
-        """Loads vectors from pickle or calls Azure to embed and saves."""
+        paths = self.taxonomy.all_path_strs()
+        cached_rows: Dict[str, np.ndarray] = {}
+
         if os.path.exists(cache_path):
             try:
                 with open(cache_path, 'rb') as f:
-                    vectors = pickle.load(f)
-                if len(vectors) == len(paths):
-                    print("Loaded embeddings from cache.")
-                    return vectors
+                    cached = pickle.load(f)
+
+                if isinstance(cached, dict):
+                    if cached.get("provider", "azure-text-embedding-3-large") != self.embedder.key:
+                        raise ValueError(f"cache was built with {cached.get('provider')}")
+                    # Zero rows are failed embeddings from an earlier run (e.g. the embed circuit was
+                    # open); only a cache without them is used as is, otherwise they are retried below
+                    if cached.get("paths") == paths and np.any(cached["vectors"], axis=1).all():
+                        logger.info("Loaded embeddings from cache.")
+                        return cached["vectors"]
+                    cached_rows = {p: v for p, v in zip(cached["paths"], cached["vectors"]) if np.any(v)}
+                elif len(cached) == len(paths):
+                    # Legacy cache: bare matrix with rows in sorted path-string order
+                    logger.info("Migrating legacy embedding cache to node-ID order.")
+                    cached_rows = {p: v for p, v in zip(sorted(paths), cached) if np.any(v)}
                 else:
-                    print("Cache mismatch (tree changed). Rebuilding...")
+                    logger.info("Cache mismatch (tree changed). Rebuilding...")
             except Exception as e:
-                print(f"Cache load error: {e}. Rebuilding...")
-        
-        print("Embedding tree (one-time operation)...")
-        vectors = self._embed_all(paths)
-        
-        # NORMALIZE vectors
-        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
-        norms[norms == 0] = 1
-        vectors = vectors / norms
-        
-        with open(cache_path, 'wb') as f:
-            pickle.dump(vectors, f)
-            
+                logger.warning("Cache load error: %s. Rebuilding...", e)
+
+        missing = [p for p in paths if p not in cached_rows]
+        if missing:
+            logger.info("Embedding %d of %d tree paths...", len(missing), len(paths))
+            new_vectors = self._embed_all(missing)
+
+            # NORMALIZE vectors
+            norms = np.linalg.norm(new_vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            new_vectors = new_vectors / norms
+            cached_rows.update(zip(missing, new_vectors))
+
+        vectors = np.vstack([cached_rows[p] for p in paths]).astype(np.float32) if paths else np.zeros((0, self.embedder.dim), dtype=np.float32)
+
+        self._save_cache(cache_path, paths, vectors)
         return vectors
 
+    def _save_cache(self, cache_path, paths, vectors):
+        # Write-then-rename so a concurrent reload never reads a half-written cache
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"provider": self.embedder.key, "paths": paths, "vectors": vectors}, f)
+        os.replace(tmp_path, cache_path)
+
     def _embed_all(self, text_list):
         """Batched embedding of the entire list."""
         vectors = []
-        batch_size = 100 
-        
+        batch_size = self.embedder.batch_size
+
         for i in range(0, len(text_list), batch_size):
             batch = text_list[i : i + batch_size]
             try:
-                resp = self.client.embeddings.create(input=batch, model=AZURE_CONFIG["deployment_embed"])
-                vecs = [d.embedding for d in resp.data]
-                vectors.append(vecs)
+                vectors.append(self.embedder.embed(batch, sheddable=False))
             except Exception as e:
-                print(f"Embed Error at batch {i}: {e}")
-                vectors.append(np.zeros((len(batch), 3072)))
-                
+                logger.error("Embed Error at batch %d: %s", i, e)
+                vectors.append(np.zeros((len(batch), self.embedder.dim)))
+
         return np.vstack(vectors).astype(np.float32)
 
-    # --- HELPER: CHECK IF PATH HAS DEFECTS ---
-    def _has_defects(self, path: str) -> bool:
-        """Returns True if the path has a non-empty list of defects associated."""
-        return path in self.defects_map and len(self.defects_map[path]) > 0
+    # --- HELPERS: ID <-> STRING BOUNDARY ---
+    def find_path(self, path: str) -> int:
+        """Resolves a "A > B > C" path string to its node ID (-1 if unknown)."""
+        return self.taxonomy.find(path)
+
+    def path_str(self, node_id: int) -> str:
+        return self.taxonomy.path_str(node_id)
+
+    def path_labels(self, node_id: int) -> List[str]:
+        return self.taxonomy.path_labels(node_id)
+
+    def defects_for(self, node_id: int) -> List[str]:
+        return self.taxonomy.defects(node_id)
+
+    @staticmethod
+    def search_context(remark: str) -> str:
+        """The text that is actually embedded for a remark (also its query-embedding cache key)."""
+        # --- FIX: Context Augmentation (The "Soft" Fix) ---
+        # Instead of replacing text, we append the definition.
+        # This biases the embedding vector towards "Left" if "Driver" is mentioned,
+        # regardless of how the user spells "driver".
+        return f"{remark} (Context: Driver Side or d/s is Left, Passenger Side is Right)"
+
+    def embed_query(self, remark: str, deadline: Deadline = None) -> Union[np.ndarray, None]:
+        """
+        Embeds the remark with the same context augmentation used for the tree search.
+        Returns the normalized vector, or None if the embedding call failed.
+        """
+        deadline = deadline or Deadline()
+        search_context = self.search_context(remark)
 
-    def classify(self, remark: str, top_k: int = 20) -> str:
+        cache_key = (self.embedder.key, search_context)
+        cached = QUERY_EMBEDDINGS.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            # We embed 'search_context', not just 'remark'
+            query_vec = self.embedder.embed([search_context], timeout=deadline.timeout())[0]
+
+            # Normalize query vector
+            norm = np.linalg.norm(query_vec)
+            if norm > 0:
+                query_vec = query_vec / norm
+            QUERY_EMBEDDINGS.put(cache_key, query_vec)
+            return query_vec
+        except Overloaded:
+            # Shed by the admission controller: surface as 503, not as a classifier miss
+            raise
+        except CircuitOpen:
+            logger.warning("Embedding circuit open. Skipping embedding call.")
+            return None
+        except Exception as e:
+            logger.error("Embedding API Error: %s", e)
+            return None
+
+    def classify(self, remark: str, top_k: int = 20, query_vec: np.ndarray = None, deadline: Deadline = None) -> Union[int, str]:
         """Classifies the remark against only paths that have associated defects."""
-        
-        # FILTER: Only select paths that have defects
-        valid_indices = [i for i, p in enumerate(self.paths) if self._has_defects(p)]
-        
-        if not valid_indices:
+
+        if len(self.taxonomy.defect_node_ids) == 0:
             return "ERROR_NO_DEFECT_PATHS"
 
-        # Subset vectors and paths
-        subset_vectors = self.vectors[valid_indices]
-        candidates_subset = [self.paths[i] for i in valid_indices]
+        return self._run_classification(remark, self.taxonomy.defect_node_ids, self.defect_vectors, top_k, query_vec, deadline)
 
-        return self._run_classification(remark, candidates_subset, subset_vectors, top_k)
-    
-    def classify_restricted(self, remark: str, allowed_paths: List[str], top_k: int = 20) -> str:
+    def classify_restricted(self, remark: str, constraint_path: str, top_k: int = 20, query_vec: np.ndarray = None, deadline: Deadline = None) -> Union[int, str]:
         """
-        Classifies the remark against allowed_paths, but strictly filters out
-        any allowed_path that does not have associated defects.
+        Classifies the remark against the subtree under constraint_path (inclusive),
+        strictly filtering out any node that does not have associated defects.
         """
-        
-        if not allowed_paths:
+        # --- 1. Identify and Validate Constraint Path ---
+        constraint_id = self.taxonomy.find(constraint_path)
+        if constraint_id < 0:
             return "ERROR_NO_PATHS"
 
-        # --- 1. Identify and Validate Constraint Path ---
-        constraint_path = ""
-        if allowed_paths:
-            path_segments = [p.split(" > ") for p in allowed_paths]
-            first_segments = path_segments[0]
-            for i in range(len(first_segments)):
-                temp_path = " > ".join(first_segments[:len(first_segments) - i])
-                is_ancestor = all(p.startswith(temp_path) for p in allowed_paths)
-                if is_ancestor:
-                    constraint_path = temp_path
-                    break
-        
-        # Calculate Ancestors (paths that must NOT be returned)
-        ancestor_segments = constraint_path.split(" > ")[:-1]
-        ancestor_paths = [" > ".join(ancestor_segments[:i+1]) for i in range(len(ancestor_segments))]
-        
-        # 2. Add constraint path IF it has defects (Fix for "higher level" logic)
-        # We only add the parent if it is a valid defect place itself.
-        if constraint_path and constraint_path not in allowed_paths:
-            if self._has_defects(constraint_path):
-                allowed_paths.append(constraint_path)
-
-        # --- 3. Vector Search with Strict Defect Filtering ---
-        # Map global paths to indices
-        path_to_index = {p: i for i, p in enumerate(self.paths)}
-        
-        # Only include paths that exist AND have defects
-        valid_indices = [
-            path_to_index[p] for p in allowed_paths 
-            if p in path_to_index and self._has_defects(p)
-        ]
-        
-        if not valid_indices:
+        # --- 2. Vector Search with Strict Defect Filtering ---
+        subtree = self.taxonomy.subtree(constraint_id)
+        lo, hi = self._subtree_defect_range(constraint_id)
+        candidate_ids = self.taxonomy.defect_node_ids[lo:hi]
+
+        if len(candidate_ids) == 0:
             # If even the constraint path has no defects, and no children have defects, we can't classify.
-            print("Restricted search: No allowed paths have associated defects.")
+            logger.info("Restricted search: No allowed paths have associated defects.")
             return "NONE" # Or handle as error
-        
-        subset_vectors = self.vectors[valid_indices]
-        candidates_subset = [self.paths[i] for i in valid_indices]
 
         # Run core classification
-        result_path = self._run_classification(remark, candidates_subset, subset_vectors, top_k)
-
-        # --- 4. Constraint Check and Fallback ---
-        
-        # A. Check for Ancestor Violation
-        if result_path in ancestor_paths:
-            # If reranker picked an invalid ancestor, fallback to constraint ONLY if it has defects
-            if self._has_defects(constraint_path):
-                print(f"Reranker violated constraint. Forcing result to: {constraint_path}")
-                return constraint_path
+        result = self._run_classification(remark, candidate_ids, self.defect_vectors[lo:hi], top_k, query_vec, deadline)
+
+        # --- 3. Constraint Check and Fallback ---
+
+        # A. Check for Constraint Violation (ancestor or any node outside the subtree)
+        if isinstance(result, int) and result not in subtree:
+            # If reranker picked an invalid node, fallback to constraint ONLY if it has defects
+            if self.taxonomy.has_defects(constraint_id):
+                logger.info("Reranker violated constraint. Forcing result to: %s", constraint_path)
+                return constraint_id
             return "NONE"
-            
+
         # B. Check for Failed Search
-        if result_path == "NONE":
+        if result == "NONE":
             # Fallback to constraint path ONLY if it has defects
-            if self._has_defects(constraint_path):
-                print(f"Restricted classification failed to find a fit. Falling back to: {constraint_path}")
-                return constraint_path
+            if self.taxonomy.has_defects(constraint_id):
+                logger.info("Restricted classification failed to find a fit. Falling back to: %s", constraint_path)
+                return constraint_id
             return "NONE"
-            
-        return result_path
 
-    def _run_classification_old(self, remark: str, candidate_paths: List[str], candidate_vectors: np.ndarray, top_k: int = 20) -> str:
-        """Core classification logic."""
-        if candidate_vectors is None or len(candidate_vectors) == 0:
-            return "ERROR_NO_INDEX"
+        return result
 
-        search_term = remark.lower().strip() 
+    def _subtree_defect_range(self, node_id: int):
+        """
+        [lo, hi) slice of taxonomy.defect_node_ids (and self.defect_vectors) under node_id.
+        The subtree is a contiguous ID range, so this is two binary searches.
+        """
+        subtree = self.taxonomy.subtree(node_id)
+        lo, hi = np.searchsorted(self.taxonomy.defect_node_ids, [subtree.start, subtree.stop])
+        return int(lo), int(hi)
 
-        # 1. Embed User Remark
-        try:
-            resp = self.client.embeddings.create(input=search_term, model=AZURE_CONFIG["deployment_embed"])
-            query_vec = np.array(resp.data[0].embedding, dtype=np.float32)
-            
-            norm = np.linalg.norm(query_vec)
-            if norm > 0:
-                query_vec = query_vec / norm
-        except Exception as e:
-            print(f"Embedding API Error: {e}")
-            return "ERROR_EMBED"
+    def classify_lexical(self, remark: str, constraint_path: str = None) -> Union[int, str]:
+        """
+        Embedding-free fallback for when Azure is unreachable: picks the defect path
+        whose labels share the most words with the remark (leaf label words count double).
+        """
+        words = lexical_tokens(remark)
+        candidate_ids = self.taxonomy.defect_node_ids
+        constraint_id = -1
+        if constraint_path:
+            constraint_id = self.taxonomy.find(constraint_path)
+            if constraint_id < 0:
+                return "ERROR_NO_PATHS"
+            lo, hi = self._subtree_defect_range(constraint_id)
+            candidate_ids = candidate_ids[lo:hi]
 
-        # 2. Vector Search
-        scores = candidate_vectors @ query_vec
-        k = min(top_k, len(scores))
-        top_indices = np.argsort(scores)[::-1][:k]
+        label_tokens = self.taxonomy.label_tokens()
+        node_label = self.taxonomy.node_label
+        best_id, best_score = -1, 0
+        for node_id in candidate_ids:
+            node_id = int(node_id)
+            score = 2 * len(words & label_tokens[node_label[node_id]])
+            for a in self.taxonomy.ancestors(node_id):
+                score += len(words & label_tokens[node_label[a]])
+            if score > best_score:
+                best_id, best_score = node_id, score
 
-        final_candidates = [candidate_paths[i] for i in top_indices]
+        if best_id >= 0:
+            return best_id
+        if constraint_id >= 0 and self.taxonomy.has_defects(constraint_id):
+            return constraint_id
+        return "NONE"
 
-        if not final_candidates:
-            return "UNCLASSIFIED"
-        
-        # 3. Rerank with GPT
-        return self._ask_gpt_best_fit(remark, final_candidates)
-    
-    def _run_classification(self, remark: str, candidate_paths: List[str], candidate_vectors: np.ndarray, top_k: int = 20) -> str:
+    def _run_classification(self, remark: str, candidate_ids: np.ndarray, candidate_vectors: np.ndarray, top_k: int = 20, query_vec: np.ndarray = None, deadline: Deadline = None) -> Union[int, str]:
         """Core classification logic shared between full and restricted search."""
         if candidate_vectors is None or len(candidate_vectors) == 0:
             return "ERROR_NO_INDEX"
 
-        # --- FIX: Context Augmentation (The "Soft" Fix) ---
-        # Instead of replacing text, we append the definition.
-        # This biases the embedding vector towards "Left" if "Driver" is mentioned,
-        # regardless of how the user spells "driver".
-        search_context = f"{remark} (Context: Driver Side or d/s is Left, Passenger Side is Right)"
-        
-        # 1. Embed the Augmented Context
-        try:
-            # We embed 'search_context', not just 'remark'
-            resp = self.client.embeddings.create(input=search_context, model=AZURE_CONFIG["deployment_embed"])
-            query_vec = np.array(resp.data[0].embedding, dtype=np.float32)
-            
-            # Normalize query vector
-            norm = np.linalg.norm(query_vec)
-            if norm > 0:
-                query_vec = query_vec / norm
-        except Exception as e:
-            print(f"Embedding API Error: {e}")
-            return "ERROR_EMBED"
+        deadline = deadline or Deadline()
+
+        # 1. Embed the Augmented Context (unless the caller already did)
+        if query_vec is None:
+            query_vec = self.embed_query(remark, deadline)
+            if query_vec is None:
+                return "ERROR_EMBED"
 
         # 2. Vector Search (Dot Product)
         scores = candidate_vectors @ query_vec
-        
+
         k = min(top_k, len(scores))
         top_indices = np.argsort(scores)[::-1][:k]
 
-        final_candidates = [candidate_paths[i] for i in top_indices]
+        final_candidates = [int(candidate_ids[i]) for i in top_indices]
 
         if not final_candidates:
             return "UNCLASSIFIED"
-        
+
         # 3. Rerank with GPT
         # We pass the original remark to GPT, but we give it a strict rule in the prompt below.
-        return self._ask_gpt_best_fit(remark, final_candidates)
+        return self._ask_gpt_best_fit(remark, final_candidates, deadline)
+
+    def _ask_gpt_best_fit(self, remark, candidate_ids, deadline: Deadline = None):
+        """
+        Asks GPT to pick the best candidate. If GPT fails or the deadline runs out,
+        falls back to the vector-search top-1 (candidate_ids[0]) and marks the
+        location stage as unreranked on the deadline.
+        """
+        deadline = deadline or Deadline()
+
+        # Compact prompt: numbered candidates, shared ancestors written once as a tree
+        cand_tree_str, numbers = render_candidate_tree(self.taxonomy, candidate_ids)
 
-    def _ask_gpt_best_fit(self, remark, candidates):
-        cand_list_str = "\n".join([f"- {c}" for c in candidates])
-        
-        # --- UPDATED PROMPT: STRICTER RULES ---
         system = (
-            "You are a strict classification assistant. Your Goal: Map the Remark to the most accurate category from the Candidates list below.\n"
+            "You are a strict classification assistant. Your Goal: Map the Remark to the most accurate category in the numbered Candidates tree.\n"
             "Rules:\n"
-            "1. You must strictly choose one of the provided candidates.\n"
-            "2. Do NOT output a parent path or a path not listed in the Candidates.\n"
-            "3. Only reply 'NONE' if the remark is completely unrelated (e.g., spam, wrong language).\n"
-            "4. Output EXACTLY the category path string, nothing else."
+            "1. You must strictly choose one of the numbered candidates. Unnumbered lines are only context.\n"
+            "2. Reply 0 only if the remark is completely unrelated (e.g., spam, wrong language).\n"
+            "3. Output ONLY the number, nothing else."
         )
-        user = f"Remark: \"{remark}\"\nCandidates:\n{cand_list_str}\nBest Fit:"
+        user = f"Remark: \"{remark}\"\nCandidates:\n{cand_tree_str}\nBest Fit number:"
+
+        def _chat(timeout):
+            with ADMISSION.slot("chat", timeout=timeout):
+                return self.client.chat.completions.create(
+                    model=AZURE_CONFIG["deployment_chat"],
+                    messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
+                    temperature=0.0,
+                    max_tokens=MAX_ANSWER_TOKENS,
+                    timeout=timeout,
+                    **logprob_kwargs()
+                )
 
         try:
-            resp = self.client.chat.completions.create(
-                model=AZURE_CONFIG["deployment_chat"],
-                messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
-                temperature=0.0
-            )
-            choice = resp.choices[0].message.content.strip().replace("'", "").replace('"', "")
-            
-            if choice in self.paths:
-                return choice
-            
-            for c in candidates:
-                if choice.lower() == c.lower():
-                    return c
-            
-            return "VAN SSL defect places"
+            # Hedged: a duplicate call is fired if the first one is slower than the recent p95
+            resp = hedged_call(_chat, deadline)
+            number = parse_candidate_number(resp.choices[0].message.content, len(numbers))
+
+            if number == 0:
+                return "NONE"
+            if number is not None:
+                probs = candidate_probabilities(resp.choices[0], len(numbers))
+                if probs is not None:
+                    deadline.record_confidence("location", round(probs[number - 1], 4))
+                return numbers[number - 1]
+            logger.warning("GPT returned no valid candidate number: %r. Using vector top-1.", resp.choices[0].message.content)
+        except Overloaded:
+            raise
+        except DeadlineExceeded:
+            logger.warning("GPT rerank hit the request deadline. Using vector top-1.")
         except Exception as e:
-            print(f"GPT Error: {e}")
-            return "ERROR_GPT"
-            
+            logger.error("GPT Error: %s. Using vector top-1.", e)
+
+        deadline.mark_unreranked("location")
+        return candidate_ids[0]
+
     def get_all_unique_defects(self) -> List[str]:
-        unique_defects = set()
-        for defects_list in self.defects_map.values():
-            unique_defects.update(defects_list)
-        return sorted(list(unique_defects))
\ No newline at end of file
+        return sorted(self.taxonomy.defect_names)
@@ -0,0 +1,149 @@
+import logging
+import os
+import re
+import time
+import threading
+import numpy as np
+from typing import List, Optional, Dict, Any
+
+from server.utils.admission import ADMISSION
+
+logger = logging.getLogger(__name__)
+
+# Which backend embeds tree paths, defect labels and remarks. Switching providers
+# switches to a separate set of index caches; vectors from different models never mix.
+EMBEDDING_CONFIG = {
+    "provider": os.getenv("EMBEDDING_PROVIDER", "azure"),
+    # Local backend: ONNX model on CPU via the optional `fastembed` package
+    "local_model": os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"),
+    "local_threads": int(os.getenv("LOCAL_EMBEDDING_THREADS", "4")),
+    "local_batch_size": int(os.getenv("LOCAL_EMBEDDING_BATCH", "64")),
+    # Concurrent inference calls; each already uses local_threads cores
+    "local_max_parallel": int(os.getenv("LOCAL_EMBEDDING_PARALLEL", "1")),
+}
+
+
+class EmbeddingProvider:
+    """
+    Turns a batch of texts into a (len(texts), dim) float32 matrix (not normalized).
+
+    `key` identifies provider + model; it namespaces the index caches and the
+    query-embedding cache.
+    """
+
+    name = "base"
+    model = ""
+    dim = 0
+    batch_size = 100  # Texts per embed() call during index builds
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.texts = 0
+        self.seconds = 0.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}-{re.sub(r'[^A-Za-z0-9._-]+', '_', self.model)}"
+
+    def cache_path(self, path: str) -> str:
+        """Index cache file for this provider (Azure keeps the original file names)."""
+        if self.name == "azure":
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{self.key}{ext}"
+
+    def embed(self, texts: List[str], timeout: Optional[float] = None, sheddable: bool = True) -> np.ndarray:
+        start = time.monotonic()
+        vectors = self._embed(texts, timeout, sheddable)
+        with self._stats_lock:
+            self.calls += 1
+            self.texts += len(texts)
+            self.seconds += time.monotonic() - start
+        return vectors
+
+    def _embed(self, texts: List[str], timeout: Optional[float], sheddable: bool) -> np.ndarray:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "provider": self.key,
+                "dim": self.dim,
+                "calls": self.calls,
+                "texts": self.texts,
+                "avg_call_ms": round(1000 * self.seconds / self.calls, 2) if self.calls else None,
+            }
+
+
+class AzureEmbeddingProvider(EmbeddingProvider):
+    """Azure OpenAI deployment, behind the shared admission controller and circuit breaker."""
+
+    name = "azure"
+
+    def __init__(self, client, deployment: str, dim: int = 3072):
+        super().__init__()
+        self.client = client
+        self.model = deployment
+        self.dim = dim
+
+    def _embed(self, texts, timeout, sheddable):
+        kwargs = {"timeout": timeout} if timeout is not None else {}
+        with ADMISSION.slot("embed", sheddable=sheddable, timeout=timeout):
+            resp = self.client.embeddings.create(input=texts, model=self.model, **kwargs)
+        return np.array([d.embedding for d in resp.data], dtype=np.float32)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Sentence-embedding model run in-process with ONNX Runtime (fastembed), batched, on CPU."""
+
+    name = "local"
+
+    def __init__(self, model: str, threads: int, batch_size: int, max_parallel: int):
+        super().__init__()
+        try:
+            from fastembed import TextEmbedding
+        except ImportError as e:
+            raise RuntimeError("EMBEDDING_PROVIDER=local needs the optional 'fastembed' package (pip install fastembed).") from e
+
+        self.model = model
+        self.batch_size = batch_size
+        logger.info("Loading local embedding model %s (%d threads)...", model, threads)
+        self._model = TextEmbedding(model_name=model, threads=threads)
+        # More parallel calls than this only oversubscribe the cores ONNX Runtime already uses
+        self._slots = threading.BoundedSemaphore(max_parallel)
+        self.dim = int(self._embed(["dimension probe"], None, False).shape[1])
+
+    def _embed(self, texts, timeout, sheddable):
+        # Runs locally: no admission control, and timeout does not apply
+        with self._slots:
+            return np.array(list(self._model.embed(texts, batch_size=self.batch_size)), dtype=np.float32)
+
+
+_PROVIDER: Optional[EmbeddingProvider] = None
+_PROVIDER_LOCK = threading.Lock()
+
+
+def get_embedding_provider(azure_client, azure_deployment: str) -> EmbeddingProvider:
+    """
+    Returns the configured provider, created on first use and then shared by every
+    classifier and taxonomy snapshot (so the local model is loaded once per process).
+    """
+    global _PROVIDER
+    with _PROVIDER_LOCK:
+        if _PROVIDER is None:
+            if EMBEDDING_CONFIG["provider"] == "local":
+                _PROVIDER = LocalEmbeddingProvider(
+                    EMBEDDING_CONFIG["local_model"],
+                    EMBEDDING_CONFIG["local_threads"],
+                    EMBEDDING_CONFIG["local_batch_size"],
+                    EMBEDDING_CONFIG["local_max_parallel"],
+                )
+            else:
+                _PROVIDER = AzureEmbeddingProvider(azure_client, azure_deployment)
+        return _PROVIDER
+
+
+def current_embedding_provider() -> Optional[EmbeddingProvider]:
+    """The provider in use, or None before the first classifier was built."""
+    return _PROVIDER
@@ -0,0 +1,161 @@
+import logging
+import os
+import re
+import pickle
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_remark(remark: str) -> str:
+    """Lowercases and collapses whitespace so trivially different remarks share a key."""
+    return re.sub(r"\s+", " ", remark.lower()).strip()
+
+
+def _is_under(path: str, constraint_path: Optional[str]) -> bool:
+    """True if path equals constraint_path or lies below it (no constraint = True)."""
+    if not constraint_path:
+        return True
+    return path == constraint_path or path.startswith(f"{constraint_path} > ")
+
+
+class RemarkExampleStore:
+    """
+    Memory of inspector-confirmed remark -> (path, defect) pairs.
+
+    Entries are appended to a pickle log on disk (one record per dump) and kept
+    in a fixed-size in-memory matrix for nearest-neighbour lookup. When the store
+    is full the oldest entry is overwritten; the log is compacted once it holds
+    twice as many records as the store can keep.
+    """
+
+    def __init__(self, store_path: str, dim: int = 3072, max_entries: int = 5000, match_threshold: float = 0.97):
+        self.store_path = store_path
+        self.dim = dim
+        self.max_entries = max_entries
+        self.match_threshold = match_threshold
+
+        self._lock = threading.Lock()
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.entries: List[Optional[Dict]] = [None] * max_entries
+        self.key_to_slot: Dict[str, int] = {}
+        self._next_slot = 0
+        self._size = 0
+        self._log_records = 0
+
+        self._load()
+        logger.info("Example Store: Loaded %d confirmed remarks.", self._size)
+
+    def __len__(self) -> int:
+        return self._size
+
+    # --- Persistence ---
+
+    def _load(self):
+        if not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, 'rb') as f:
+                while True:
+                    try:
+                        record = pickle.load(f)
+                    except EOFError:
+                        break
+                    self._log_records += 1
+                    self._insert(record)
+        except Exception as e:
+            # A truncated tail (e.g. crash mid-write) only loses the last record.
+            logger.warning("Example store load error: %s. Continuing with %d entries.", e, self._size)
+
+    def _append_to_log(self, record: Dict):
+        with open(self.store_path, 'ab') as f:
+            pickle.dump(record, f)
+        self._log_records += 1
+
+        if self._log_records > 2 * self.max_entries:
+            self._compact_log()
+
+    def _compact_log(self):
+        """Rewrites the log with only the live entries, oldest first."""
+        live = self._live_slots_oldest_first()
+        tmp_path = f"{self.store_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            for slot in live:
+                pickle.dump(self.entries[slot], f)
+        os.replace(tmp_path, self.store_path)
+        self._log_records = len(live)
+
+    def _live_slots_oldest_first(self) -> List[int]:
+        if self._size < self.max_entries:
+            return [i for i in range(self._size) if self.entries[i] is not None]
+        order = list(range(self._next_slot, self.max_entries)) + list(range(0, self._next_slot))
+        return [i for i in order if self.entries[i] is not None]
+
+    # --- In-memory index ---
+
+    def _insert(self, record: Dict):
+        vec = np.asarray(record["vector"], dtype=np.float32)
+        if vec.shape != (self.dim,):
+            return
+        key = record["key"]
+
+        # Same remark confirmed again: overwrite in place so the newest label wins.
+        if key in self.key_to_slot:
+            slot = self.key_to_slot[key]
+        else:
+            slot = self._next_slot
+            evicted = self.entries[slot]
+            if evicted is not None:
+                self.key_to_slot.pop(evicted["key"], None)
+            self._next_slot = (self._next_slot + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+        self.entries[slot] = record
+        self.vectors[slot] = vec
+        self.key_to_slot[key] = slot
+
+    # --- Public API ---
+
+    def add(self, remark: str, path: str, defect: str, vector: np.ndarray):
+        """Records a confirmed remark. `vector` must be the normalized query embedding."""
+        record = {
+            "key": normalize_remark(remark),
+            "remark": remark,
+            "path": path,
+            "defect": defect,
+            "vector": np.asarray(vector, dtype=np.float32),
+            "created_at": time.time(),
+        }
+        with self._lock:
+            self._insert(record)
+            self._append_to_log(record)
+
+    def lookup(self, query_vec: np.ndarray, remark: str = "", constraint_path: Optional[str] = None) -> Optional[Dict]:
+        """
+        Returns the closest confirmed example if it clears the match threshold
+        (or is an exact normalized-text match), else None. With a constraint
+        path only examples located under that path are considered.
+        """
+        with self._lock:
+            if self._size == 0:
+                return None
+
+            key = normalize_remark(remark) if remark else None
+            if key and key in self.key_to_slot:
+                entry = self.entries[self.key_to_slot[key]]
+                if _is_under(entry["path"], constraint_path):
+                    return {"path": entry["path"], "defect": entry["defect"], "score": 1.0}
+
+            scores = self.vectors[:self._size] @ query_vec
+            for slot in np.argsort(scores)[::-1][:5]:
+                score = float(scores[slot])
+                if score < self.match_threshold:
+                    break
+                entry = self.entries[slot]
+                if not _is_under(entry["path"], constraint_path):
+                    continue
+                return {"path": entry["path"], "defect": entry["defect"], "score": score}
+        return None
@@ -1,9 +1,20 @@
+import logging
 import os
 import pickle
 import numpy as np
-import openai
 from typing import List, Dict
 
+from server.classes.taxonomy_model import TaxonomyModel, lexical_tokens
+from server.classes.rerank_prompt import (
+    MAX_ANSWER_TOKENS, render_candidate_list, parse_candidate_number, logprob_kwargs, candidate_probabilities
+)
+from server.utils.admission import ADMISSION, Overloaded
+from server.utils.hedging import Deadline, DeadlineExceeded, hedged_call
+from server.classes.classifier import QUERY_EMBEDDINGS
+from server.classes.embedding_provider import get_embedding_provider
+
+logger = logging.getLogger(__name__)
+
 # Load config from env in real app
 AZURE_CONFIG = {
     "api_key": os.getenv("API_KEY"),
@@ -17,94 +28,162 @@ os.environ["AZURE_TENANT_ID"] = os.getenv("AZURE_TENANT_ID")
 
 
 class ContextualDefectClassifier:
-    def __init__(self, all_unique_defects: List[str], cache_path: str):
+    def __init__(self, all_unique_defects: List[str], cache_path: str, taxonomy: TaxonomyModel = None):
+        # Imported here so loading this module (e.g. by the routes) stays off the startup critical path
+        import openai
         self.client = openai.AzureOpenAI(
             api_key=AZURE_CONFIG["api_key"],
             api_version=AZURE_CONFIG["api_version"],
-            azure_endpoint=AZURE_CONFIG["azure_endpoint"]
+            azure_endpoint=AZURE_CONFIG["azure_endpoint"],
+            # No SDK-internal retries: admission control and the circuit breaker must see every 429/5xx
+            max_retries=0
         )
+        self.embedder = get_embedding_provider(self.client, AZURE_CONFIG["deployment_embed"])
         
         # Master Index of all possible defects
         self.master_categories = sorted(list(set(all_unique_defects)))
-        print(f"Defect Classifier: Loaded {len(self.master_categories)} unique defect types.")
+        logger.info("Defect Classifier: Loaded %d unique defect types.", len(self.master_categories))
 
         # Map label -> Index in the master matrix (for fast lookup)
         self.label_to_index = {label: i for i, label in enumerate(self.master_categories)}
 
         # Build Global Vectors (The Master Index)
-        self.master_vectors = self._load_or_build_vectors(self.master_categories, cache_path)
+        self.master_vectors = self._load_or_build_vectors(self.master_categories, self.embedder.cache_path(cache_path))
+
+        # Per-node defect submatrices (node ID -> shared defect set, -1 = none)
+        self.node_to_set = np.zeros(0, dtype=np.int32)
+        self.set_labels: List[List[str]] = []
+        self.set_vectors: List[np.ndarray] = []
+        if taxonomy is not None:
+            self.build_path_index(taxonomy)
+
+    def build_path_index(self, taxonomy: TaxonomyModel):
+        """
+        Precomputes the defect submatrix for every taxonomy node so that a request
+        only needs an array lookup plus one matmul. Nodes with an identical defect
+        list share one submatrix.
+        """
+        self.node_to_set = np.full(len(taxonomy), -1, dtype=np.int32)
+        self.set_labels = []
+        self.set_vectors = []
+        if self.master_vectors is None:
+            return
+
+        # Taxonomy defect ID -> row in the master matrix (-1 if not embedded)
+        defect_to_master = np.array(
+            [self.label_to_index.get(d, -1) for d in taxonomy.defect_names], dtype=np.intp
+        )
+
+        key_to_set: Dict[bytes, int] = {}
+        for node_id in taxonomy.defect_node_ids:
+            indices = defect_to_master[taxonomy.defect_id_slice(node_id)]
+            # Sorted (and deduplicated) so the same set in a different order shares one submatrix;
+            # results are re-sorted by score anyway
+            indices = np.unique(indices[indices >= 0])
+            if len(indices) == 0:
+                continue
+            key = indices.tobytes()
+            if key not in key_to_set:
+                key_to_set[key] = len(self.set_labels)
+                self.set_labels.append([self.master_categories[i] for i in indices])
+                self.set_vectors.append(np.ascontiguousarray(self.master_vectors[indices]))
+            self.node_to_set[node_id] = key_to_set[key]
+
+        indexed = int(np.count_nonzero(self.node_to_set >= 0))
+        logger.info("Defect Classifier: Indexed %d paths with %d distinct defect sets.", indexed, len(self.set_labels))
 
     def _load_or_build_vectors(self, categories, cache_path):
+        """Loads defect vectors from cache, embedding only labels not cached yet."""
+        cached_rows: Dict[str, np.ndarray] = {}
         if os.path.exists(cache_path):
             try:
                 with open(cache_path, 'rb') as f:
                     data = pickle.load(f)
-                if len(data) == len(categories):
-                    print("Loaded defect embeddings from cache.")
-                    return data
+                if isinstance(data, dict):
+                    if data.get("provider", "azure-text-embedding-3-large") != self.embedder.key:
+                        raise ValueError(f"cache was built with {data.get('provider')}")
+                    # Zero rows are failed embeddings from an earlier run; those are re-embedded below
+                    if data.get("labels") == categories and np.any(data["vectors"], axis=1).all():
+                        logger.info("Loaded defect embeddings from cache.")
+                        return data["vectors"]
+                    cached_rows = {c: v for c, v in zip(data["labels"], data["vectors"]) if np.any(v)}
+                elif len(data) == len(categories):
+                    # Legacy cache: bare matrix aligned with the sorted category list
+                    cached_rows = {c: v for c, v in zip(categories, data) if np.any(v)}
             except:
-                print("Defect cache error. Rebuilding...")
+                logger.warning("Defect cache error. Rebuilding...")
                 pass 
         
-        print("Embedding defect types (Master Index)...")
-        vectors = self._embed_batch(categories)
-        
-        # Normalize vectors
-        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
-        norms[norms == 0] = 1
-        vectors = vectors / norms
-        
-        with open(cache_path, 'wb') as f:
-            pickle.dump(vectors, f)
+        missing = [c for c in categories if c not in cached_rows]
+        if missing:
+            logger.info("Embedding %d of %d defect types (Master Index)...", len(missing), len(categories))
+            new_vectors = self._embed_batch(missing)
+
+            # Normalize vectors
+            norms = np.linalg.norm(new_vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            new_vectors = new_vectors / norms
+            cached_rows.update(zip(missing, new_vectors))
+
+        if not categories:
+            return None
+        vectors = np.vstack([cached_rows[c] for c in categories]).astype(np.float32)
+
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"provider": self.embedder.key, "labels": categories, "vectors": vectors}, f)
+        os.replace(tmp_path, cache_path)
         return vectors
 
     def _embed_batch(self, text_list):
         """Batched embedding of the entire list."""
         vectors = []
-        batch_size = 100
+        batch_size = self.embedder.batch_size
         for i in range(0, len(text_list), batch_size):
             batch = text_list[i : i + batch_size]
             try:
-                resp = self.client.embeddings.create(input=batch, model=AZURE_CONFIG["deployment_embed"])
-                vecs = [d.embedding for d in resp.data]
-                vectors.append(vecs)
+                vectors.append(self.embedder.embed(batch, sheddable=False))
             except Exception as e:
-                print(f"Embed Error: {e}")
-                vectors.append(np.zeros((len(batch), 3072)))
+                logger.error("Embed Error: %s", e)
+                vectors.append(np.zeros((len(batch), self.embedder.dim)))
         return np.vstack(vectors).astype(np.float32)
 
-    def predict(self, remark: str, allowed_defects: List[str], top_k: int = 5) -> List[Dict]:
+    def predict_for_node(self, remark: str, node_id: int, top_k: int = 5, deadline: Deadline = None) -> List[Dict]:
         """
-        Predicts defect by performing a search strictly against 'allowed_defects'.
+        Predicts defect for a taxonomy node using the precomputed submatrix.
+        Returns [] if the node has no indexed defects.
         """
-        if self.master_vectors is None or not allowed_defects: 
+        if node_id < 0 or node_id >= len(self.node_to_set) or self.node_to_set[node_id] < 0:
             return []
+        set_id = self.node_to_set[node_id]
+        return self._search_and_rerank(remark, self.set_labels[set_id], self.set_vectors[set_id], top_k, deadline)
 
-        # 1. Identify indices for the allowed subset
-        valid_indices = []
-        valid_labels = []
-        for d in allowed_defects:
-            if d in self.label_to_index:
-                valid_indices.append(self.label_to_index[d])
-                valid_labels.append(d)
-        
-        if not valid_indices:
-            return []
+    def _search_and_rerank(self, remark: str, valid_labels: List[str], subset_vectors: np.ndarray, top_k: int, deadline: Deadline = None) -> List[Dict]:
+        """
+        Embeds the remark, searches the given defect subset and reranks with GPT.
+        If the rerank cannot finish within the deadline, the vector order is returned as is.
+        """
+        deadline = deadline or Deadline()
 
-        # 2. Embed Query
+        # 2. Embed Query (cached per remark text)
+        cache_key = (self.embedder.key, remark)
+        q_vec = QUERY_EMBEDDINGS.get(cache_key)
         try:
-            resp = self.client.embeddings.create(input=remark, model=AZURE_CONFIG["deployment_embed"])
-            q_vec = np.array(resp.data[0].embedding, dtype=np.float32)
-            norm = np.linalg.norm(q_vec)
-            if norm > 0: q_vec = q_vec / norm
+            if q_vec is None:
+                q_vec = self.embedder.embed([remark], timeout=deadline.timeout())[0]
+                norm = np.linalg.norm(q_vec)
+                if norm > 0: q_vec = q_vec / norm
+                QUERY_EMBEDDINGS.put(cache_key, q_vec)
+        except Overloaded:
+            # Shed by the admission controller: surface as 503, not as a classifier miss
+            raise
         except Exception as e:
-            print(f"Embedding API Error: {e}")
-            return []
+            # Azure unreachable (or circuit open): rank by word overlap instead
+            logger.warning("Embedding API Error: %s. Using lexical defect ranking.", e)
+            deadline.mark_unreranked("defect")
+            return self._lexical_candidates(remark, valid_labels, top_k)
 
         # 3. MASKED Vector Search
-        # Slice the master matrix to only include allowed rows
-        subset_vectors = self.master_vectors[valid_indices]
-        
         scores = subset_vectors @ q_vec
         
         # Sort results
@@ -119,49 +198,85 @@ class ContextualDefectClassifier:
             })
             
         # 4. GPT Reranking
-        best_label = self._rerank_with_gpt(remark, [c['label'] for c in candidates])
-        
-        if best_label and best_label != "NONE":
-            # Reorder list: Put winner first
+        best_label, probs = self._rerank_with_gpt(remark, [c['label'] for c in candidates], deadline)
+
+        if probs is not None:
+            # Calibrated: every candidate gets the model's probability, cosine kept alongside
+            for c, p in zip(candidates, probs):
+                c['vector_score'] = c['score']
+                c['score'] = round(p, 4)
+            candidates.sort(key=lambda x: (x['score'], x['vector_score']), reverse=True)
+        elif best_label and best_label not in ("NONE", "ERROR_GPT"):
+            # No logprobs: put the winner first but leave the cosine scores as they are
             candidates.sort(key=lambda x: x['label'] == best_label, reverse=True)
-            # Boost score of winner visually for the frontend
-            if candidates[0]['label'] == best_label:
-                candidates[0]['score'] = max(candidates[0]['score'], 0.99)
 
         return candidates[:10]
 
-    def _rerank_with_gpt(self, remark, candidate_labels):
-        cand_str = "\n".join([f"- {c}" for c in candidate_labels])
-        system = "You are a QA expert. Pick the SINGLE best defect category from the list. If the remark is vague, pick the most likely one based on automotive context. Return ONLY the category name."
-        user = f"Remark: \"{remark}\"\nCandidates:\n{cand_str}\nBest Category:"
+    def _lexical_candidates(self, remark: str, labels: List[str], top_k: int) -> List[Dict]:
+        """Embedding-free ranking: fraction of each label's words that appear in the remark."""
+        words = lexical_tokens(remark)
+        candidates = []
+        for label in labels:
+            label_words = lexical_tokens(label)
+            score = len(words & label_words) / len(label_words) if label_words else 0.0
+            candidates.append({"label": label, "score": score})
+        candidates.sort(key=lambda c: c["score"], reverse=True)
+        return candidates[:min(top_k, 10)]
+
+    def _rerank_with_gpt(self, remark, candidate_labels, deadline: Deadline = None):
+        """
+        Returns (best label or "NONE"/"ERROR_GPT", per-candidate probabilities).
+        Probabilities come from the answer token's logprobs and are None when unavailable.
+        """
+        deadline = deadline or Deadline()
+        cand_str = render_candidate_list(candidate_labels)
+        system = "You are a QA expert. Pick the SINGLE best defect category from the numbered list. If the remark is vague, pick the most likely one based on automotive context. Return ONLY the number."
+        user = f"Remark: \"{remark}\"\nCandidates:\n{cand_str}\nBest Category number:"
+
+        def _chat(timeout):
+            with ADMISSION.slot("chat", timeout=timeout):
+                return self.client.chat.completions.create(
+                    model=AZURE_CONFIG["deployment_chat"],
+                    messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
+                    temperature=0.0,
+                    max_tokens=MAX_ANSWER_TOKENS,
+                    timeout=timeout,
+                    **logprob_kwargs()
+                )
         
         try:
-            resp = self.client.chat.completions.create(
-                model=AZURE_CONFIG["deployment_chat"],
-                messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
-                temperature=0.0
-            )
-            choice = resp.choices[0].message.content.strip().replace("'", "").replace('"', "")
-            
-            if choice in candidate_labels: return choice
-            for c in candidate_labels:
-                if choice.lower() == c.lower(): return c
-            return "NONE"
+            resp = hedged_call(_chat, deadline)
+            choice = resp.choices[0]
+            number = parse_candidate_number(choice.message.content, len(candidate_labels))
+            probs = candidate_probabilities(choice, len(candidate_labels))
+            if number: return candidate_labels[number - 1], probs
+            return "NONE", probs
+        except Overloaded:
+            raise
+        except DeadlineExceeded:
+            logger.warning("GPT rerank hit the request deadline. Keeping vector order.")
+            deadline.mark_unreranked("defect")
+            return "ERROR_GPT", None
         except Exception as e:
-            print(f"GPT Rerank Error: {e}")
-            return "ERROR_GPT"
+            logger.error("GPT Rerank Error: %s", e)
+            deadline.mark_unreranked("defect")
+            return "ERROR_GPT", None
 
 class FlatClassifier:
     def __init__(self, file_path, cache_path):
+        # Imported here so loading this module (e.g. by the routes) stays off the startup critical path
+        import openai
         self.client = openai.AzureOpenAI(
             api_key=AZURE_CONFIG["api_key"],
             api_version=AZURE_CONFIG["api_version"],
-            azure_endpoint=AZURE_CONFIG["azure_endpoint"]
+            azure_endpoint=AZURE_CONFIG["azure_endpoint"],
+            # No SDK-internal retries: admission control and the circuit breaker must see every 429/5xx
+            max_retries=0
         )
         
         # 1. Load Categories
         if not os.path.exists(file_path):
-            print(f"WARNING: {file_path} not found.")
+            logger.warning("%s not found.", file_path)
             self.categories = []
             self.vectors = None
             return
@@ -169,7 +284,7 @@ class FlatClassifier:
         with open(file_path, 'r', encoding='utf-8') as f:
             self.categories = [line.strip() for line in f.readlines() if line.strip()]
             
-        print(f"Flat Classifier: Loaded {len(self.categories)} types.")
+        logger.info("Flat Classifier: Loaded %d types.", len(self.categories))
 
         # 2. Build/Load Vectors
         self.vectors = self._load_or_build_vectors(self.categories, cache_path)
@@ -184,7 +299,7 @@ class FlatClassifier:
             except:
                 pass 
         
-        print("Embedding defect types...")
+        logger.info("Embedding defect types...")
         vectors = self._embed_batch(categories)
         
         norms = np.linalg.norm(vectors, axis=1, keepdims=True)
@@ -201,11 +316,12 @@ class FlatClassifier:
         for i in range(0, len(text_list), batch_size):
             batch = text_list[i : i + batch_size]
             try:
-                resp = self.client.embeddings.create(input=batch, model=AZURE_CONFIG["deployment_embed"])
+                with ADMISSION.slot("embed", sheddable=False):
+                    resp = self.client.embeddings.create(input=batch, model=AZURE_CONFIG["deployment_embed"])
                 vecs = [d.embedding for d in resp.data]
                 vectors.append(vecs)
             except Exception as e:
-                print(f"Embed Error: {e}")
+                logger.error("Embed Error: %s", e)
                 vectors.append(np.zeros((len(batch), 3072)))
         return np.vstack(vectors).astype(np.float32)
 
@@ -218,10 +334,13 @@ class FlatClassifier:
 
         # 1. Vector Search
         try:
-            resp = self.client.embeddings.create(input=remark, model=AZURE_CONFIG["deployment_embed"])
+            with ADMISSION.slot("embed"):
+                resp = self.client.embeddings.create(input=remark, model=AZURE_CONFIG["deployment_embed"])
             q_vec = np.array(resp.data[0].embedding, dtype=np.float32)
             norm = np.linalg.norm(q_vec)
             if norm > 0: q_vec = q_vec / norm
+        except Overloaded:
+            raise
         except:
             return []
 
@@ -237,15 +356,12 @@ class FlatClassifier:
             
         # 2. GPT Reranking
         # We ask GPT to pick the best fit from the candidates.
-        # We then move that winner to the top of the list with a boosted score.
+        # We then move that winner to the top of the list; scores stay cosine similarities.
         best_label = self._rerank_with_gpt(remark, [c['label'] for c in candidates])
         
         if best_label and best_label != "NONE":
             # Reorder list: Put winner first
             candidates.sort(key=lambda x: x['label'] == best_label, reverse=True)
-            # Boost score of winner visually
-            if candidates[0]['label'] == best_label:
-                candidates[0]['score'] = 0.99
 
         return candidates
 
@@ -255,16 +371,19 @@ class FlatClassifier:
         user = f"Remark: \"{remark}\"\nCandidates:\n{cand_str}\nBest Category:"
         
         try:
-            resp = self.client.chat.completions.create(
-                model=AZURE_CONFIG["deployment_chat"],
-                messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
-                temperature=0.0
-            )
+            with ADMISSION.slot("chat"):
+                resp = self.client.chat.completions.create(
+                    model=AZURE_CONFIG["deployment_chat"],
+                    messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
+                    temperature=0.0
+                )
             choice = resp.choices[0].message.content.strip().replace("'", "").replace('"', "")
             
             if choice in candidate_labels: return choice
             for c in candidate_labels:
                 if choice.lower() == c.lower(): return c
             return None
+        except Overloaded:
+            raise
         except:
             return None
\ No newline at end of file
@@ -0,0 +1,99 @@
+import os
+import re
+import math
+from typing import List, Optional, Tuple
+
+from server.classes.taxonomy_model import TaxonomyModel
+
+# Enough for a number (plus stray whitespace); the model never has to echo a path
+MAX_ANSWER_TOKENS = 4
+
+# Ask for token logprobs on the answer so every candidate gets a probability from the same call.
+# OpenAI caps top_logprobs at 20, which covers our candidate lists.
+RERANK_LOGPROBS = os.getenv("RERANK_LOGPROBS", "1") == "1"
+TOP_LOGPROBS = 20
+
+
+def logprob_kwargs() -> dict:
+    """Extra chat.completions.create arguments for the scoring mode."""
+    return {"logprobs": True, "top_logprobs": TOP_LOGPROBS} if RERANK_LOGPROBS else {}
+
+
+def render_candidate_tree(taxonomy: TaxonomyModel, candidate_ids: List[int]) -> Tuple[str, List[int]]:
+    """
+    Renders candidates as an indented tree so shared ancestors are written once:
+
+        VAN SSL defect places
+          Door
+            [1] Handle
+          [2] Roof
+
+    Returns the text and the node ID for each number (numbers[i - 1] -> node ID).
+    Candidates are numbered in tree order, which keeps related paths adjacent.
+    """
+    candidate_set = set(int(i) for i in candidate_ids)
+    nodes = set(candidate_set)
+    for node_id in candidate_set:
+        nodes.update(taxonomy.ancestors(node_id))
+
+    lines = []
+    numbers: List[int] = []
+    # Node IDs are pre-order, so sorting them yields a valid tree walk
+    for node_id in sorted(nodes):
+        indent = "  " * int(taxonomy.depth[node_id])
+        label = taxonomy.labels[taxonomy.node_label[node_id]]
+        if node_id in candidate_set:
+            numbers.append(node_id)
+            lines.append(f"{indent}[{len(numbers)}] {label}")
+        else:
+            lines.append(f"{indent}{label}")
+    return "\n".join(lines), numbers
+
+
+def render_candidate_list(labels: List[str]) -> str:
+    return "\n".join(f"[{i}] {label}" for i, label in enumerate(labels, start=1))
+
+
+def parse_candidate_number(text: str, count: int) -> Optional[int]:
+    """
+    Returns the chosen 1-based candidate number, 0 for "none of them",
+    or None if the reply is not a valid number.
+    """
+    match = re.search(r"\d+", text or "")
+    if not match:
+        return 0 if "NONE" in (text or "").upper() else None
+    number = int(match.group())
+    return number if 0 <= number <= count else None
+
+
+def candidate_probabilities(choice, count: int) -> Optional[List[float]]:
+    """
+    Turns the logprobs of the answer's number token into a probability per
+    candidate (index i -> candidate number i + 1). The denominator is the mass
+    of every returned alternative, including "0"/NONE and unparseable tokens,
+    so the probabilities sum to less than 1 when the model hedged towards
+    "none of them" (a lone candidate does not automatically score 1.0).
+    Returns None if the response carries no usable logprobs.
+    """
+    logprobs = getattr(choice, "logprobs", None)
+    content = getattr(logprobs, "content", None) if logprobs else None
+    if not content:
+        return None
+
+    # The first non-whitespace token is the number (or a stray bracket before it)
+    token_info = next((t for t in content if t.token.strip(" [")), None)
+    if token_info is None:
+        return None
+
+    probs = [0.0] * count
+    total = 0.0
+    for alt in (token_info.top_logprobs or []):
+        p = math.exp(alt.logprob)
+        total += p
+        text = alt.token.strip(" []")
+        if text.isdigit() and 1 <= int(text) <= count:
+            probs[int(text) - 1] += p
+
+    if total <= 0:
+        return None
+    return [p / total for p in probs]
@@ -0,0 +1,153 @@
+import re
+import json
+import numpy as np
+from typing import List, Dict, Union
+
+# Keys inside a tree node that hold metadata rather than child categories
+META_KEYS = ("__defects__", "__spass_code__")
+PATH_SEP = " > "
+
+
+def lexical_tokens(text: str) -> frozenset:
+    """Lowercase word set used by the embedding-free fallback matchers."""
+    return frozenset(w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) > 1)
+
+
+class TaxonomyModel:
+    """
+    Compact, array-backed view of the taxonomy tree.
+
+    Nodes are numbered in depth-first pre-order (children sorted by label), so
+    the subtree of node i is the contiguous ID range [i, subtree_end[i]).
+    Labels and defect names are interned; per-node defects are stored CSR-style
+    in defect_offsets/defect_ids. Path strings are only built on request.
+    """
+
+    def __init__(self, tree: Dict):
+        self.labels: List[str] = []
+        self.label_index: Dict[str, int] = {}
+        self.defect_names: List[str] = []
+        self.defect_index: Dict[str, int] = {}
+
+        node_label: List[int] = []
+        parent: List[int] = []
+        depth: List[int] = []
+        subtree_end: List[int] = []
+        defect_offsets: List[int] = [0]
+        defect_ids: List[int] = []
+        # (parent_id, label_id) -> node_id, used to resolve path strings
+        self._child_index: Dict[tuple, int] = {}
+
+        def add_node(key: str, node, parent_id: int, node_depth: int):
+            node_id = len(node_label)
+            label_id = self._intern_label(key)
+            node_label.append(label_id)
+            parent.append(parent_id)
+            depth.append(node_depth)
+            subtree_end.append(node_id + 1)
+            self._child_index[(parent_id, label_id)] = node_id
+
+            if isinstance(node, dict):
+                for d in dict.fromkeys(node.get("__defects__") or []):
+                    defect_ids.append(self._intern_defect(d))
+            defect_offsets.append(len(defect_ids))
+
+            if isinstance(node, dict):
+                for child_key in sorted(k for k in node.keys() if k not in META_KEYS):
+                    add_node(child_key, node[child_key], node_id, node_depth + 1)
+            subtree_end[node_id] = len(node_label)
+
+        if isinstance(tree, dict):
+            for key in sorted(k for k in tree.keys() if k not in META_KEYS):
+                add_node(key, tree[key], -1, 0)
+
+        self.node_label = np.array(node_label, dtype=np.int32)
+        self.parent = np.array(parent, dtype=np.int32)
+        self.depth = np.array(depth, dtype=np.int16)
+        self.subtree_end = np.array(subtree_end, dtype=np.int32)
+        self.defect_offsets = np.array(defect_offsets, dtype=np.int32)
+        self.defect_ids = np.array(defect_ids, dtype=np.int32)
+
+        defect_counts = np.diff(self.defect_offsets)
+        # Nodes that can be returned as a classification result
+        self.defect_node_ids = np.flatnonzero(defect_counts > 0).astype(np.int32)
+
+    @classmethod
+    def from_json_file(cls, path: str) -> "TaxonomyModel":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def __len__(self) -> int:
+        return len(self.node_label)
+
+    def _intern_label(self, label: str) -> int:
+        if label not in self.label_index:
+            self.label_index[label] = len(self.labels)
+            self.labels.append(label)
+        return self.label_index[label]
+
+    def _intern_defect(self, defect: str) -> int:
+        if defect not in self.defect_index:
+            self.defect_index[defect] = len(self.defect_names)
+            self.defect_names.append(defect)
+        return self.defect_index[defect]
+
+    # --- Structure ---
+
+    def has_defects(self, node_id: int) -> bool:
+        return self.defect_offsets[node_id + 1] > self.defect_offsets[node_id]
+
+    def defect_id_slice(self, node_id: int) -> np.ndarray:
+        return self.defect_ids[self.defect_offsets[node_id]:self.defect_offsets[node_id + 1]]
+
+    def subtree(self, node_id: int) -> range:
+        """All node IDs under (and including) node_id."""
+        return range(node_id, int(self.subtree_end[node_id]))
+
+    def ancestors(self, node_id: int) -> List[int]:
+        """Strict ancestors of node_id, root first."""
+        chain = []
+        node_id = int(self.parent[node_id])
+        while node_id >= 0:
+            chain.append(node_id)
+            node_id = int(self.parent[node_id])
+        return chain[::-1]
+
+    # --- String boundary ---
+
+    def path_labels(self, node_id: int) -> List[str]:
+        return [self.labels[self.node_label[i]] for i in self.ancestors(node_id) + [node_id]]
+
+    def path_str(self, node_id: int) -> str:
+        return PATH_SEP.join(self.path_labels(node_id))
+
+    def all_path_strs(self) -> List[str]:
+        """Path strings for every node, indexed by node ID (built in one pass)."""
+        paths: List[str] = []
+        for node_id in range(len(self)):
+            label = self.labels[self.node_label[node_id]]
+            parent_id = self.parent[node_id]
+            paths.append(f"{paths[parent_id]}{PATH_SEP}{label}" if parent_id >= 0 else label)
+        return paths
+
+    def find(self, path: Union[str, List[str]]) -> int:
+        """Resolves a "A > B > C" string (or label list) to a node ID, or -1."""
+        parts = [p.strip() for p in path.split(">")] if isinstance(path, str) else path
+        node_id = -1
+        for part in parts:
+            label_id = self.label_index.get(part)
+            if label_id is None:
+                return -1
+            node_id = self._child_index.get((node_id, label_id), -1)
+            if node_id < 0:
+                return -1
+        return node_id
+
+    def defects(self, node_id: int) -> List[str]:
+        return [self.defect_names[d] for d in self.defect_id_slice(node_id)]
+
+    def label_tokens(self) -> List[frozenset]:
+        """Word sets per interned label (built on first use)."""
+        if not hasattr(self, "_label_tokens"):
+            self._label_tokens = [lexical_tokens(label) for label in self.labels]
+        return self._label_tokens
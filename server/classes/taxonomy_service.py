@@ -0,0 +1,222 @@
+import logging
+import os
+import json
+import time
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Callable
+
+from server.classes.classifier import VariableDepthClassifier
+from server.classes.flat_classifier import ContextualDefectClassifier
+from server.utils.precompressed import PrecompressedJSON
+from server.utils.profiler import PROFILER
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TaxonomySnapshot:
+    """Everything derived from one version of the taxonomy file. Never mutated after build."""
+    version: str
+    tree_data: Dict[str, Any]
+    tree_payload: PrecompressedJSON  # tree_data serialized + compressed once, served by GET /api/tree
+    tree_classifier: VariableDepthClassifier
+    defect_classifier: ContextualDefectClassifier
+    loaded_at: float
+
+
+def _read_tree(tree_path: str) -> Optional[bytes]:
+    if not os.path.exists(tree_path):
+        return None
+    with open(tree_path, 'rb') as f:
+        return f.read()
+
+
+def _version_of(raw: Optional[bytes]) -> str:
+    return hashlib.sha1(raw).hexdigest()[:12] if raw is not None else "missing"
+
+
+def compute_version(tree_path: str) -> str:
+    """Content hash of the tree file, used as the taxonomy version ID."""
+    return _version_of(_read_tree(tree_path))
+
+
+def build_snapshot(tree_path: str, tree_cache: str, defect_cache: str,
+                   progress: Callable[[str], None] = lambda stage: None) -> TaxonomySnapshot:
+    """
+    Loads the tree and both classifiers (embedding only what the caches miss).
+    `progress` is called with a short stage name before each step.
+    """
+    progress("reading_tree")
+    # Read once: the version hash, the UI tree and the classifier all come from the
+    # same bytes, even if the file is being rewritten while we load
+    raw = _read_tree(tree_path)
+    version = _version_of(raw)
+
+    # Load Tree Data (for UI dropdowns)
+    tree_data = json.loads(raw.decode('utf-8')) if raw is not None else {}
+    tree_payload = PrecompressedJSON(tree_data, etag=version)
+
+    # 1. Load Tree Classifier (This extracts all paths AND defects into its state)
+    progress("loading_tree_index")
+    tree_classifier = VariableDepthClassifier(tree_path, tree_cache, tree_data if raw is not None else None)
+
+    # 2. Extract ALL unique defects from the loaded tree
+    all_defects = tree_classifier.get_all_unique_defects()
+
+    # 3. Initialize Contextual Defect Classifier with the Master List
+    # (also precomputes the per-path defect submatrices)
+    progress("loading_defect_index")
+    defect_classifier = ContextualDefectClassifier(all_defects, defect_cache, tree_classifier.taxonomy)
+
+    return TaxonomySnapshot(
+        version=version,
+        tree_data=tree_data,
+        tree_payload=tree_payload,
+        tree_classifier=tree_classifier,
+        defect_classifier=defect_classifier,
+        loaded_at=time.time(),
+    )
+
+
+class TaxonomyManager:
+    """
+    Owns the live TaxonomySnapshot on app.state.taxonomy.
+
+    Reloads build a complete new snapshot in a worker thread and then replace
+    the attribute in one assignment. Requests grab the snapshot once at the
+    start, so in-flight requests finish on the version they started with.
+    """
+
+    def __init__(self, app, tree_path: str, tree_cache: str, defect_cache: str):
+        self.app = app
+        self.tree_path = tree_path
+        self.tree_cache = tree_cache
+        self.defect_cache = defect_cache
+
+        self._reload_lock = asyncio.Lock()
+        self._reload_task: Optional[asyncio.Task] = None
+        self.reloading = False
+        self.stage = "not_started"  # Progress of the initial load, "ready" once serving
+        self.last_error: Optional[str] = None
+        self.failed_attempts = 0  # Failed initial load attempts so far
+        self._watched_mtime = self._tree_mtime()
+
+    @property
+    def current(self) -> Optional[TaxonomySnapshot]:
+        return getattr(self.app.state, "taxonomy", None)
+
+    def _tree_mtime(self) -> float:
+        return os.path.getmtime(self.tree_path) if os.path.exists(self.tree_path) else 0.0
+
+    def _swap(self, snapshot: TaxonomySnapshot):
+        # Single attribute assignment: readers see either the old or the new snapshot
+        self.app.state.taxonomy = snapshot
+        logger.info("Taxonomy version %s is live.", snapshot.version)
+
+    @property
+    def ready(self) -> bool:
+        return self.current is not None
+
+    @property
+    def failed(self) -> bool:
+        """True while the initial load is failing (between retries)."""
+        return self.stage == "failed"
+
+    def _set_stage(self, stage: str):
+        self.stage = stage
+
+    async def load_initial(self, retry_delay: float = 5.0, max_retry_delay: float = 300.0):
+        """
+        Initial load, run as a background task so the server can bind its port
+        before the (possibly embedding-heavy) index build finishes.
+        Retries with exponential backoff until it succeeds.
+        """
+        attempt = 0
+        while self.current is None:  # An admin reload may have succeeded in the meantime
+            attempt += 1
+            try:
+                # Same lock as reload(): two concurrent builds would repeat the embedding pass
+                # and write the same cache .tmp files
+                async with self._reload_lock:
+                    snapshot = await asyncio.to_thread(
+                        PROFILER.trace_allocations,
+                        build_snapshot, self.tree_path, self.tree_cache, self.defect_cache, self._set_stage
+                    )
+                    self._swap(snapshot)
+                    self.last_error = None
+            except Exception as e:
+                self.stage = "failed"
+                self.last_error = str(e)
+                self.failed_attempts = attempt
+                delay = min(max_retry_delay, retry_delay * 2 ** (attempt - 1))
+                logger.exception("Initial taxonomy load failed (attempt %d); retrying in %.0f s.", attempt, delay)
+                await asyncio.sleep(delay)
+        self.stage = "ready"
+
+    async def reload(self, force: bool = False) -> str:
+        """
+        Rebuilds the snapshot in the background and swaps it in.
+        Skips the rebuild if the file content hash is unchanged (unless forced).
+        Returns the live version after the call.
+        """
+        async with self._reload_lock:
+            self._watched_mtime = self._tree_mtime()
+            new_version = await asyncio.to_thread(compute_version, self.tree_path)
+            current = self.current
+            if current is not None and current.version == new_version and not force:
+                return current.version
+
+            self.reloading = True
+            try:
+                # Traced with tracemalloc only if an admin armed an allocation capture
+                snapshot = await asyncio.to_thread(
+                    PROFILER.trace_allocations,
+                    build_snapshot, self.tree_path, self.tree_cache, self.defect_cache
+                )
+                self._swap(snapshot)
+                self.last_error = None
+            except Exception as e:
+                # Keep serving the old version
+                logger.error("Taxonomy reload failed: %s", e)
+                self.last_error = str(e)
+            finally:
+                self.reloading = False
+
+            return self.current.version if self.current else "none"
+
+    def start_reload(self, force: bool = False) -> bool:
+        """
+        Schedules reload() without awaiting it. Returns False if one is already
+        running, or if the initial load has not finished yet.
+        """
+        if not self.ready:
+            return False
+        if self._reload_task is not None and not self._reload_task.done():
+            return False
+        self._reload_task = asyncio.create_task(self.reload(force=force))
+        return True
+
+    async def watch(self, interval: float):
+        """Polls the tree file's mtime and reloads when it changes."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self._tree_mtime() != self._watched_mtime:
+                    logger.info("Taxonomy file changed on disk. Reloading...")
+                    await self.reload()
+            except Exception as e:
+                logger.error("Taxonomy watch error: %s", e)
+
+    def status(self) -> Dict[str, Any]:
+        current = self.current
+        return {
+            "version": current.version if current else None,
+            "loaded_at": current.loaded_at if current else None,
+            "stage": self.stage,
+            "reloading": self.reloading or (self._reload_task is not None and not self._reload_task.done()),
+            "last_error": self.last_error,
+            "failed_attempts": self.failed_attempts,
+            "tree_payload_bytes": current.tree_payload.sizes() if current else None,
+        }
@@ -37,10 +37,29 @@ def _env_safe(name: str) -> str:
 class Settings:
     environment: str
     port: int
+    admin_token: Optional[str]  # Admin endpoints are disabled when unset
+    taxonomy_watch_interval: float  # Seconds between tree file checks, 0 = off
+    analyze_deadline: float  # Time budget (seconds) for one /api/analyze call
+    review_threshold: float  # Calibrated confidence below which a result is flagged for review
+    profiling_enabled: bool  # Allows the /api/admin/profile endpoints
+    analysis_history: bool  # Record every /api/analyze result in the local SQLite history
+    analysis_db_path: str
+    analysis_history_max_rows: int  # Rows kept in the history (and cached query embeddings), 0 = unlimited
+    analysis_history_max_days: float  # Age limit for history rows, 0 = unlimited
 
 
 def load_settings() -> Settings:
     return Settings(
         environment=_env_guaranteed("ENVIRONMENT", "production"),
         port=int(_env_guaranteed("PORT", "8000")),
+        admin_token=_env("ADMIN_TOKEN"),
+        taxonomy_watch_interval=float(_env_guaranteed("TAXONOMY_WATCH_INTERVAL", "0")),
+        analyze_deadline=float(_env_guaranteed("ANALYZE_DEADLINE_SECONDS", "20")),
+        review_threshold=float(_env_guaranteed("REVIEW_CONFIDENCE_THRESHOLD", "0.6")),
+        profiling_enabled=_env_guaranteed("PROFILING_ENABLED", "0") == "1",
+        analysis_history=_env_guaranteed("ANALYSIS_HISTORY", "1") == "1",
+        # Next to the log files in server/ (git-ignored) regardless of the working directory
+        analysis_db_path=_env_guaranteed("ANALYSIS_DB_PATH", str(Path(__file__).parent.parent / "analysis_history.sqlite3")),
+        analysis_history_max_rows=int(_env_guaranteed("ANALYSIS_HISTORY_MAX_ROWS", "100000")),
+        analysis_history_max_days=float(_env_guaranteed("ANALYSIS_HISTORY_MAX_DAYS", "90")),
     )
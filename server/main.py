@@ -1,16 +1,22 @@
 import os
-import json
-from fastapi import FastAPI, HTTPException
+import asyncio
+import logging
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
 from server.config.config import Settings, load_settings
-from server.routes import helloworld, taxonomy  # <--- 1. Import taxonomy
-from server.classes.classifier import VariableDepthClassifier # <--- 2. Import Service
-from server.classes.flat_classifier import FlatClassifier 
-from server.classes.flat_classifier import ContextualDefectClassifier # <--- Use the new class
+from server.utils.logger import request_id_var, new_request_id
+from server.routes import helloworld, taxonomy, admin  # <--- 1. Import taxonomy
+from server.classes.example_store import RemarkExampleStore
+from server.classes.embedding_provider import current_embedding_provider
+from server.classes.analysis_store import AnalysisStore, ANALYSIS_RESULTS
+from server.classes.classifier import QUERY_EMBEDDINGS
+from server.classes.taxonomy_service import TaxonomyManager
+from server.utils.single_flight import SingleFlight
+from server.utils.admission import ADMISSION
 
 '''
 ToDos:
@@ -43,6 +49,21 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+logger = logging.getLogger(__name__)
+
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    # Tag every log record of this request (including worker-thread classifier logs) with one ID
+    request_id = request.headers.get("x-request-id") or new_request_id()
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 
 """@app.on_event("startup")
 async def startup_event():
@@ -68,7 +89,7 @@ async def startup_event():
 
 @app.on_event("startup")
 async def startup_event():
-    print("Loading Contextual Classifiers...")
+    logger.info("Loading Contextual Classifiers...")
     
     # Tree Paths
     tree_path = "shrunken_tree.json" 
@@ -77,23 +98,76 @@ async def startup_event():
     # Defect Type Cache (No longer needs the separate text file)
     defect_cache = "defect_types_master_embeddings.pkl" # Renamed cache for clarity
 
-    # Load Tree Data (for UI dropdowns)
-    if os.path.exists(tree_path):
-        with open(tree_path, 'r', encoding='utf-8') as f:
-            app.state.tree_data = json.load(f)
-    else:
-        app.state.tree_data = {}
-
-    # 1. Load Tree Classifier (This extracts all paths AND defects into its state)
-    app.state.tree_classifier = VariableDepthClassifier(tree_path, tree_cache)
-    
-    # 2. Extract ALL unique defects from the loaded tree
-    all_defects = app.state.tree_classifier.get_all_unique_defects()
-    
-    # 3. Initialize Contextual Defect Classifier with the Master List
-    app.state.defect_classifier = ContextualDefectClassifier(all_defects, defect_cache)
+    # Append-only log of inspector-confirmed remarks
+    example_store_path = "remark_examples.pkl"
+
+    app.state.settings = settings
+
+    # Coalesces concurrent identical /api/analyze calls into one computation
+    app.state.analysis_flight = SingleFlight()
+
+    # 1-3. Load tree data + both classifiers as one versioned snapshot (app.state.taxonomy).
+    # This runs in the background so the port opens immediately; /ready reports progress
+    # and /api/analyze answers 503 until it is done. Later reloads swap it atomically.
+    app.state.taxonomy_manager = TaxonomyManager(app, tree_path, tree_cache, defect_cache)
+    app.state.startup_task = asyncio.create_task(_load_indexes(example_store_path))
+    app.state.startup_task.add_done_callback(_on_startup_done)
+
+    logger.info("Server accepting connections; indexes loading in background.")
+
+
+def _on_startup_done(task: asyncio.Task):
+    # Nothing awaits the background task, so its exception would otherwise go unnoticed
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logger.error("Background startup failed: %s", error, exc_info=error)
+        app.state.startup_error = str(error)
+
+
+async def _load_indexes(example_store_path: str):
+    manager = app.state.taxonomy_manager
+    await manager.load_initial()
+
+    # 4. Load confirmed examples (inspector feedback) for near-duplicate lookup.
+    # Stored vectors live in the embedding provider's space, so each provider has its own store.
+    embedder = current_embedding_provider()
+    dim = 3072
+    if embedder is not None:
+        example_store_path, dim = embedder.cache_path(example_store_path), embedder.dim
+    app.state.example_store = await asyncio.to_thread(RemarkExampleStore, example_store_path, dim)
+
+    # 5. Analysis history: records every result, and warms the query-embedding and
+    # result caches from earlier runs so repeated remarks stay cheap across restarts
+    if settings.analysis_history:
+        try:
+            store = await asyncio.to_thread(
+                AnalysisStore,
+                settings.analysis_db_path,
+                max_rows=settings.analysis_history_max_rows,
+                max_age=settings.analysis_history_max_days * 86400,
+            )
+            snapshot = manager.current
+            warmed = await asyncio.to_thread(
+                store.warm,
+                embedder.key if embedder else None,
+                snapshot.version if snapshot else None,
+                QUERY_EMBEDDINGS,
+                ANALYSIS_RESULTS,
+            )
+            logger.info("Analysis history: warmed %d embeddings and %d results.", warmed["embeddings"], warmed["results"])
+            app.state.analysis_store = store
+        except Exception:
+            # The history is optional; serve without it rather than stall the rest of startup
+            logger.exception("Analysis history unavailable; continuing without it.")
+
+    if settings.taxonomy_watch_interval > 0:
+        app.state.taxonomy_watch_task = asyncio.create_task(
+            manager.watch(settings.taxonomy_watch_interval)
+        )
         
-    print("Startup complete.")
+    logger.info("Startup complete.")
 """
 @app.on_event("startup")
 async def startup_event():
@@ -122,16 +196,53 @@ async def startup_event():
         
     print("Startup complete.")"""
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Flush queued history rows before the process exits
+    store = getattr(app.state, "analysis_store", None)
+    if store is not None:
+        await asyncio.to_thread(store.close)
+
+
 @app.get("/health")
 async def health_check():
     '''
     A simple health check endpoint.
+    Fails if the background startup crashed or the initial taxonomy load keeps failing
+    (it is retried in the background meanwhile).
     '''
+    error = getattr(app.state, "startup_error", None)
+    manager = getattr(app.state, "taxonomy_manager", None)
+    if error is None and manager is not None and manager.failed:
+        error = manager.last_error
+    if error is not None:
+        return JSONResponse(status_code=503, content={"status": "error", "detail": error})
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    '''
+    Readiness endpoint: 200 once the classifiers are loaded, else 503 with the load stage.
+    Unlike /health this is expected to fail while the indexes are being built.
+    '''
+    manager = getattr(app.state, "taxonomy_manager", None)
+    ready = (
+        manager is not None
+        and manager.ready
+        and getattr(app.state, "example_store", None) is not None
+    )
+    status = manager.status() if manager else {"stage": "not_started"}
+    # Open breakers do not make the instance unready (local fallbacks still answer), but are reported
+    status["circuit_breakers"] = {kind: b["state"] for kind, b in ADMISSION.breaker_stats().items()}
+    if not ready:
+        return JSONResponse(status_code=503, content={"status": "loading", **status}, headers={"Retry-After": "5"})
+    return {"status": "ready", **status}
+
+
 app.include_router(helloworld.router)
 app.include_router(taxonomy.router, prefix="/api") 
+app.include_router(admin.router)
 
 
 # We deploy a FastAPI server that serves static client files
@@ -0,0 +1,184 @@
+import io
+import csv
+import json
+import asyncio
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Query
+from fastapi.responses import Response, StreamingResponse
+
+from server.utils.admission import ADMISSION
+from server.utils.hedging import hedge_stats
+from server.utils.profiler import PROFILER
+from server.classes.classifier import QUERY_EMBEDDINGS
+from server.classes.analysis_store import ANALYSIS_RESULTS, EXPORT_COLUMNS
+from server.classes.embedding_provider import current_embedding_provider
+
+
+def require_admin(request: Request, x_admin_token: Optional[str] = Header(None)):
+    """Rejects the call unless X-Admin-Token matches ADMIN_TOKEN."""
+    expected = request.app.state.settings.admin_token
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled.")
+    if not secrets.compare_digest(x_admin_token or "", expected):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+
+router = APIRouter(
+    prefix="/api/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)],
+)
+
+
+# --- Taxonomy Reload ---
+@router.post("/reload", status_code=202)
+async def reload_taxonomy(request: Request, force: bool = False):
+    """
+    Rebuilds the taxonomy and classifiers in the background and swaps them in.
+    Poll GET /api/admin/taxonomy for progress.
+    """
+    manager = request.app.state.taxonomy_manager
+    if not manager.ready:
+        raise HTTPException(status_code=409, detail="The initial taxonomy load is still running.")
+    if not manager.start_reload(force=force):
+        return {"status": "already_reloading", **manager.status()}
+    return {"status": "reload_started", **manager.status()}
+
+
+@router.get("/taxonomy")
+async def taxonomy_status(request: Request):
+    """Live taxonomy version and reload state."""
+    return request.app.state.taxonomy_manager.status()
+
+
+# --- Metrics ---
+@router.get("/metrics")
+async def metrics(request: Request):
+    """Runtime counters for the request pipeline."""
+    embedder = current_embedding_provider()
+    store = getattr(request.app.state, "analysis_store", None)
+    return {
+        "analysis_single_flight": request.app.state.analysis_flight.stats(),
+        "azure_admission": ADMISSION.stats(),
+        "chat_hedging": hedge_stats(),
+        "circuit_breakers": ADMISSION.breaker_stats(),
+        "query_embedding_cache": QUERY_EMBEDDINGS.stats(),
+        "embedding_provider": embedder.stats() if embedder else None,
+        "analysis_result_cache": ANALYSIS_RESULTS.stats(),
+        "analysis_history": store.stats() if store else None,
+    }
+
+
+# --- Analysis History ---
+def _history(request: Request):
+    store = getattr(request.app.state, "analysis_store", None)
+    if store is None:
+        raise HTTPException(status_code=503, detail="Analysis history is disabled or still loading.")
+    return store
+
+
+def _history_filters(
+    since: Optional[float] = Query(None, description="Unix timestamp, inclusive"),
+    until: Optional[float] = Query(None, description="Unix timestamp, exclusive"),
+    taxonomy_version: Optional[str] = None,
+    path_prefix: Optional[str] = Query(None, description='e.g. "VAN SSL defect places > Door"'),
+    defect: Optional[str] = None,
+    needs_review: Optional[bool] = None,
+):
+    return {
+        "since": since, "until": until, "taxonomy_version": taxonomy_version,
+        "path_prefix": path_prefix, "defect": defect, "needs_review": needs_review,
+    }
+
+
+@router.get("/analyses")
+async def list_analyses(
+    request: Request,
+    filters: dict = Depends(_history_filters),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Recorded analyses, newest first. Rows still queued for writing are not visible yet."""
+    store = _history(request)
+    rows = await asyncio.to_thread(store.query, filters, limit, offset)
+    return {"count": len(rows), "offset": offset, "rows": rows}
+
+
+@router.get("/analyses/export")
+async def export_analyses(
+    request: Request,
+    filters: dict = Depends(_history_filters),
+    format: str = Query("jsonl", pattern="^(jsonl|csv)$"),
+):
+    """Streams all matching analyses as JSON lines or CSV (candidates/timings as JSON strings)."""
+    store = _history(request)
+
+    def lines():
+        if format == "jsonl":
+            for row in store.iter_rows(filters):
+                yield json.dumps(row, ensure_ascii=False) + "\n"
+            return
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        for row in store.iter_rows(filters):
+            writer.writerow({**row, "candidates": json.dumps(row["candidates"]), "timings": json.dumps(row["timings"])})
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    media_type = "application/x-ndjson" if format == "jsonl" else "text/csv"
+    headers = {"Content-Disposition": f'attachment; filename="analyses.{format}"'}
+    return StreamingResponse(lines(), media_type=media_type, headers=headers)
+
+
+# --- Profiling ---
+def require_profiling(request: Request):
+    if not request.app.state.settings.profiling_enabled:
+        raise HTTPException(status_code=403, detail="Profiling is disabled (PROFILING_ENABLED=0).")
+
+
+@router.get("/profile", dependencies=[Depends(require_profiling)])
+async def profile_status():
+    """State of the CPU and allocation captures and the results ready for download."""
+    return PROFILER.status()
+
+
+@router.post("/profile/cpu", status_code=202, dependencies=[Depends(require_profiling)])
+async def start_cpu_profile(
+    requests: int = Query(20, ge=1, le=1000),
+    mode: str = Query("sample", pattern="^(sample|cprofile)$"),
+    interval_ms: float = Query(5.0, ge=1.0, le=100.0),
+):
+    """
+    Profiles the next `requests` /api/analyze computations.
+    sample: stack samples every interval_ms -> collapsed stacks for flamegraph.pl/speedscope.
+    cprofile: merged cProfile stats -> .prof for snakeviz/flameprof.
+    """
+    if not PROFILER.arm_cpu(requests, mode, interval_ms / 1000):
+        raise HTTPException(status_code=409, detail="A CPU capture is already running.")
+    return PROFILER.status()
+
+
+@router.post("/profile/allocations", status_code=202, dependencies=[Depends(require_profiling)])
+async def start_allocation_profile(request: Request):
+    """Traces allocations of a forced taxonomy index rebuild with tracemalloc."""
+    if not request.app.state.taxonomy_manager.ready:
+        raise HTTPException(status_code=409, detail="The initial taxonomy load is still running.")
+    if not PROFILER.arm_allocations():
+        raise HTTPException(status_code=409, detail="An allocation capture is already pending.")
+    request.app.state.taxonomy_manager.start_reload(force=True)
+    return PROFILER.status()
+
+
+@router.get("/profile/download", dependencies=[Depends(require_profiling)])
+async def download_profile(kind: str = Query("cpu", pattern="^(cpu|allocations)$")):
+    """Downloads the latest capture of the given kind."""
+    result = PROFILER.results.get(kind)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No {kind} profile captured yet.")
+    filename, payload, media_type = result
+    return Response(payload, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -1,9 +1,29 @@
+import json
+import time
+import logging
+import asyncio
 from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+
+from server.classes.classifier import STATUS_RESULTS, QUERY_EMBEDDINGS
+from server.classes.analysis_store import ANALYSIS_RESULTS
+from server.classes.example_store import normalize_remark
+from server.classes.taxonomy_model import META_KEYS, PATH_SEP
+from server.utils.admission import Overloaded
+from server.utils.hedging import Deadline
+from server.utils.precompressed import etag_matches
+from server.utils.profiler import PROFILER
+from server.utils.logger import request_id_var
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Sent with 503s during startup so clients back off instead of hammering the server
+RETRY_AFTER = {"Retry-After": "5"}
+
 # 1. UPDATED Request Model to include optional constraint path
 class AnalysisRequest(BaseModel):
     remark: str
@@ -12,19 +32,81 @@ class AnalysisRequest(BaseModel):
 # --- Shared Models (Kept as before) ---
 class DefectCandidate(BaseModel):
     label: str
-    score: float
+    score: Optional[float] = None  # GPT probability when the rerank returned logprobs, cosine similarity otherwise; None from memory
+    vector_score: Optional[float] = None  # Cosine similarity, set when score is a GPT probability
 
 class AnalysisResponse(BaseModel):
     path_list: List[str]
     full_path_str: str
     defect_candidates: List[DefectCandidate]
+    from_memory: bool = False  # True if answered from a confirmed example
+    memory_similarity: Optional[float] = None  # Remark-to-remark similarity of that example (not a probability)
+    taxonomy_version: str = ""  # Version of the taxonomy that produced this result
+    unreranked: bool = False  # True if GPT did not finish in time and vector-search order was used
+    path_confidence: Optional[float] = None  # GPT probability of the chosen path, if available
+    needs_review: bool = False  # True if a calibrated confidence fell below the review threshold
+
+class FeedbackRequest(BaseModel):
+    remark: str
+    full_path_str: str
+    defect: str
 
 # --- Endpoints ---
 
 @router.get("/tree")
-async def get_taxonomy_tree(request: Request) -> Dict[str, Any]:
-    """Retrieves the full taxonomy tree structure for frontend dropdown rendering."""
-    return getattr(request.app.state, "tree_data", {})
+async def get_taxonomy_tree(request: Request):
+    """
+    Retrieves the full taxonomy tree structure for frontend dropdown rendering.
+    Served from the snapshot's pre-serialized, precompressed payload with an ETag.
+    """
+    snapshot = getattr(request.app.state, "taxonomy", None)
+    if not snapshot:
+        # Not {}: an empty tree would look valid and the client would never ask again
+        raise HTTPException(status_code=503, detail="Taxonomy is still loading.", headers=RETRY_AFTER)
+    return snapshot.tree_payload.response(request)
+
+@router.get("/tree/children")
+async def get_taxonomy_children(
+    request: Request,
+    path: str = Query("", description='Parent path ("A > B"); empty for the top level')
+):
+    """
+    Returns one level of the tree: the node's metadata plus its child labels,
+    so dropdowns can load lazily instead of fetching the whole tree.
+    """
+    snapshot = getattr(request.app.state, "taxonomy", None)
+    if not snapshot:
+        raise HTTPException(status_code=503, detail="Taxonomy is still loading.", headers=RETRY_AFTER)
+
+    etag = f'W/"{snapshot.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    node = snapshot.tree_data
+    labels = [p.strip() for p in path.split(PATH_SEP.strip())] if path.strip() else []
+    for label in labels:
+        child = node.get(label) if label not in META_KEYS else None
+        if not isinstance(child, dict):
+            raise HTTPException(status_code=404, detail=f"Unknown path: {path}")
+        node = child
+
+    children = [
+        {
+            "label": label,
+            "has_children": any(k not in META_KEYS for k in child),
+            "has_defects": bool(child.get("__defects__")),
+        }
+        for label, child in node.items()
+        if label not in META_KEYS and isinstance(child, dict)
+    ]
+    body = {
+        "path": PATH_SEP.join(labels),
+        "defects": node.get("__defects__", []),
+        "spass_code": node.get("__spass_code__"),
+        "children": children,
+    }
+    return JSONResponse(body, headers=headers)
 
 @router.post("/analyze", response_model=AnalysisResponse)
 async def analyze_remark(
@@ -35,59 +117,216 @@ async def analyze_remark(
     Analyzes the remark to determine the location and then the defect type, 
     optionally constraining the location search space.
     """
-    # Get Classifiers
-    tree_clf = getattr(request.app.state, "tree_classifier", None)
-    defect_clf = getattr(request.app.state, "defect_classifier", None)
+    # Get Classifiers (one snapshot for the whole request, so a concurrent
+    # taxonomy reload cannot mix versions mid-request)
+    snapshot = getattr(request.app.state, "taxonomy", None)
     
-    if not tree_clf or not defect_clf:
-        # Check both are initialized as both are required for full functionality
-        raise HTTPException(status_code=503, detail="Classifiers not initialized.")
+    if not snapshot or not snapshot.tree_classifier or not snapshot.defect_classifier:
+        # Check both are initialized as both are required for full functionality.
+        # Fail fast while the background startup is still building the indexes.
+        raise HTTPException(status_code=503, detail="Classifiers are still loading.", headers=RETRY_AFTER)
+
+    example_store = getattr(request.app.state, "example_store", None)
+    analysis_store = getattr(request.app.state, "analysis_store", None)
+
+    # Identical remarks already being analyzed (double-clicks, templated remarks from
+    # several terminals) share one run instead of each paying for the Azure calls.
+    # The blocking classifier calls run in a worker thread to keep the event loop free.
+    flight = request.app.state.analysis_flight
+    key = (normalize_remark(body.remark), body.constraint_path or "", snapshot.version)
+
+    # Fixed time budget for the whole pipeline; stages degrade to vector-only results when it runs out
+    settings = request.app.state.settings
+    deadline = Deadline(settings.analyze_deadline)
+    try:
+        return await flight.do(
+            key,
+            lambda: asyncio.to_thread(
+                *_profiled(_run_analysis), snapshot, example_store, analysis_store,
+                body.remark, body.constraint_path, deadline, settings.review_threshold,
+            ),
+        )
+    except Overloaded as e:
+        # Shed early instead of letting the request queue up behind a 429 storm
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _profiled(fn) -> tuple:
+    """(fn,) normally; (PROFILER.profile_call, fn) while an admin CPU capture is armed."""
+    return (PROFILER.profile_call, fn) if PROFILER.cpu_armed else (fn,)
+
+def _run_analysis(snapshot, example_store, analysis_store, remark: str, constraint_path: Optional[str],
+                  deadline: Deadline, review_threshold: float = 0.0) -> Dict[str, Any]:
+    """Runs the pipeline and queues the result for the analysis history (if enabled)."""
+    start = time.monotonic()
+    timings: Dict[str, float] = {}
+    response, source = _analyze(snapshot, example_store, remark, constraint_path, deadline, review_threshold, timings)
+    timings["total_ms"] = round(1000 * (time.monotonic() - start), 1)
+
+    if analysis_store is not None:
+        # The query embeddings are kept too, so a restart can warm QUERY_EMBEDDINGS
+        embedder = snapshot.tree_classifier.embedder
+        embeddings = []
+        for text in (snapshot.tree_classifier.search_context(remark), remark):
+            vector = QUERY_EMBEDDINGS.peek((embedder.key, text))
+            if vector is not None:
+                embeddings.append((embedder.key, text, vector))
+
+        candidates = response["defect_candidates"]
+        analysis_store.record({
+            "created_at": time.time(),
+            "request_id": request_id_var.get(),
+            "remark": remark,
+            "remark_key": normalize_remark(remark),
+            "constraint_path": constraint_path or "",
+            "taxonomy_version": snapshot.version,
+            "source": source,
+            "full_path_str": response["full_path_str"],
+            "defect": candidates[0]["label"] if candidates else None,
+            "candidates": json.dumps(candidates),
+            "path_confidence": response.get("path_confidence"),
+            "unreranked": int(response.get("unreranked", False)),
+            "needs_review": int(response.get("needs_review", False)),
+            "timings": json.dumps(timings),
+            "response": json.dumps(response),
+        }, embeddings)
+    return response
+
+def _analyze(snapshot, example_store, remark: str, constraint_path: Optional[str], deadline: Deadline,
+             review_threshold: float, timings: Dict[str, float]) -> Tuple[Dict[str, Any], str]:
+    """
+    Full location + defect pipeline for one remark against one taxonomy snapshot.
+    Returns (response, source) where source is "memory", "cache" or "computed";
+    per-stage durations are written into `timings`.
+    """
+    tree_clf = snapshot.tree_classifier
+    defect_clf = snapshot.defect_classifier
+    clock = time.monotonic()
+
+    def lap(stage: str):
+        nonlocal clock
+        now = time.monotonic()
+        timings[f"{stage}_ms"] = round(1000 * (now - clock), 1)
+        clock = now
+
+    # --- 0. EMBED ONCE & CHECK CONFIRMED EXAMPLES ---
+    # The same query vector is reused for the example lookup and the tree search.
+    query_vec = tree_clf.embed_query(remark, deadline)
+    lap("embed")
+
+    if query_vec is not None and example_store is not None:
+        hit = example_store.lookup(query_vec, remark, constraint_path)
+        hit_id = tree_clf.find_path(hit["path"]) if hit else -1
+        if hit_id >= 0 and hit["defect"] in tree_clf.defects_for(hit_id):
+            # Near-duplicate of an inspector-confirmed remark: no GPT call needed.
+            return {
+                "path_list": tree_clf.path_labels(hit_id),
+                "full_path_str": tree_clf.path_str(hit_id),
+                "defect_candidates": [{"label": hit["defect"], "score": None}],
+                "from_memory": True,
+                "memory_similarity": hit["score"],
+                "taxonomy_version": snapshot.version
+            }, "memory"
+
+    # Same remark already fully analyzed on this taxonomy version (this run or, via warming, an earlier one)
+    result_key = (normalize_remark(remark), constraint_path or "", snapshot.version)
+    cached = ANALYSIS_RESULTS.get(result_key)
+    if cached is not None:
+        return cached, "cache"
 
     # --- 1. CLASSIFY PATH (Location) ---
     
-    # 1a. Determine the classification method based on the request
-    if body.constraint_path:
+    # 1a. Determine the classification method based on the request.
+    # The location rerank may use at most 60% of what is left, so the defect stage keeps a budget.
+    location_deadline = deadline.sub(0.6)
+    if query_vec is None:
+        # Embedding unavailable (Azure down / circuit open): lexical match on the labels
+        logger.warning("No query embedding. Falling back to lexical path matching.")
+        result = tree_clf.classify_lexical(remark, constraint_path)
+        deadline.mark_unreranked("location")
+    elif constraint_path:
         # User manually corrected the path (e.g., "Car > Interior"). 
-        # Find all valid paths under this constraint.
-        print(f"Running restricted classification. Constraint: {body.constraint_path}")
-        
-        # Filter all known paths to only those starting with the constraint
-        all_paths = tree_clf.paths
-        allowed_paths = [p for p in all_paths if p.startswith(body.constraint_path)]
-        
-        # Run restricted search
-        full_path_str = tree_clf.classify_restricted(body.remark, allowed_paths)
+        # Search only the subtree under this constraint.
+        logger.info("Running restricted classification. Constraint: %s", constraint_path)
+        result = tree_clf.classify_restricted(remark, constraint_path, query_vec=query_vec, deadline=location_deadline)
     else:
         # Standard full search
-        full_path_str = tree_clf.classify(body.remark)
+        result = tree_clf.classify(remark, query_vec=query_vec, deadline=location_deadline)
+    lap("location")
     
     # --- 2. HANDLE PATH RESULT ---
-    
-    # Check if the classification was successful
-    if full_path_str in ["NONE", "UNCLASSIFIED", "ERROR_EMBED", "ERROR_GPT", "ERROR_NO_INDEX", "ERROR_NO_PATHS"]:
-         path_list = []
-         full_path_str = ""
-         allowed_defects = []
-         print(f"Path classification failed with: {full_path_str}")
-    else:
-        path_list = [p.strip() for p in full_path_str.split(">")]
-        
-        # 3. CONTEXTUAL DEFECT LOOKUP (New Logic)
-        # Use the final path string to get the list of allowed defects for the defect classifier
-        allowed_defects = tree_clf.defects_map.get(full_path_str, [])
-        
-        if not allowed_defects:
-            print(f"WARNING: No '__defects__' found for path: {full_path_str}. Using empty list.")
-
-    # --- 4. CLASSIFY DEFECT TYPE ---
+    # Classifiers work on node IDs; strings are only built here for the response.
     defect_candidates: List[DefectCandidate] = []
-    
-    if allowed_defects:
-        # Run contextual prediction using the filtered list
-        defect_candidates = defect_clf.predict(body.remark, allowed_defects, top_k=20)
-    
-    return {
+
+    if result in STATUS_RESULTS:
+        logger.info("Path classification failed with: %s", result)
+        path_list = []
+        full_path_str = ""
+    else:
+        path_list = tree_clf.path_labels(result)
+        full_path_str = tree_clf.path_str(result)
+
+        # --- 3. CLASSIFY DEFECT TYPE ---
+        # Run contextual prediction using the node's precomputed defect submatrix
+        defect_candidates = defect_clf.predict_for_node(remark, result, top_k=20, deadline=deadline)
+
+        if not defect_candidates:
+            logger.warning("No '__defects__' found for path: %s. Using empty list.", full_path_str)
+        lap("defect")
+
+    # --- 4. CONFIDENCE GATE ---
+    # Only calibrated scores count: the path probability and the top defect's probability.
+    path_confidence = deadline.confidence.get("location")
+    confidences = [path_confidence] if path_confidence is not None else []
+    if defect_candidates and defect_candidates[0].get("vector_score") is not None:
+        confidences.append(defect_candidates[0]["score"])
+    needs_review = bool(deadline.degraded) or any(c < review_threshold for c in confidences)
+
+    response = {
         "path_list": path_list,
         "full_path_str": full_path_str,
-        "defect_candidates": defect_candidates
-    }
\ No newline at end of file
+        "defect_candidates": defect_candidates,
+        "taxonomy_version": snapshot.version,
+        "unreranked": bool(deadline.degraded),
+        "path_confidence": path_confidence,
+        "needs_review": needs_review
+    }
+    # Degraded or failed results are not reused; the next request gets a fresh attempt
+    if full_path_str and not deadline.degraded:
+        ANALYSIS_RESULTS.put(result_key, response)
+    return response, "computed"
+
+@router.post("/feedback")
+async def submit_feedback(
+    request: Request,
+    body: FeedbackRequest
+):
+    """
+    Stores an inspector-confirmed remark -> (path, defect) pair so that
+    near-duplicate remarks can be answered without re-running the classifiers.
+    """
+    snapshot = getattr(request.app.state, "taxonomy", None)
+    example_store = getattr(request.app.state, "example_store", None)
+
+    if not snapshot or example_store is None:
+        raise HTTPException(status_code=503, detail="Example store is still loading.", headers=RETRY_AFTER)
+
+    if not body.remark.strip():
+        raise HTTPException(status_code=422, detail="Remark must not be empty.")
+
+    tree_clf = snapshot.tree_classifier
+
+    node_id = tree_clf.find_path(body.full_path_str)
+    if node_id < 0:
+        raise HTTPException(status_code=422, detail=f"Unknown path: {body.full_path_str}")
+    if body.defect not in tree_clf.defects_for(node_id):
+        raise HTTPException(status_code=422, detail=f"Defect '{body.defect}' is not valid for this path.")
+
+    try:
+        query_vec = await asyncio.to_thread(tree_clf.embed_query, body.remark)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if query_vec is None:
+        raise HTTPException(status_code=502, detail="Embedding failed.")
+
+    example_store.add(body.remark, tree_clf.path_str(node_id), body.defect, query_vec)
+    return {"status": "ok", "stored_examples": len(example_store)}
@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+from server.utils.circuit_breaker import BREAKER_CONFIG, CircuitBreaker, is_timeout
+
+# Per-deployment budgets; override via env for the actual Azure quota
+ADMISSION_CONFIG = {
+    "embed": {
+        "rate_per_sec": float(os.getenv("AZURE_EMBED_RPS", "20")),
+        "burst": int(os.getenv("AZURE_EMBED_BURST", "40")),
+        "initial_concurrency": 8,
+        "max_concurrency": int(os.getenv("AZURE_EMBED_MAX_CONCURRENCY", "32")),
+        "latency_target": 2.0,
+    },
+    "chat": {
+        "rate_per_sec": float(os.getenv("AZURE_CHAT_RPS", "5")),
+        "burst": int(os.getenv("AZURE_CHAT_BURST", "10")),
+        "initial_concurrency": 4,
+        "max_concurrency": int(os.getenv("AZURE_CHAT_MAX_CONCURRENCY", "16")),
+        "latency_target": 8.0,
+    },
+    # Callers allowed to wait per kind before new ones are shed, and how long they may wait
+    "max_queue": int(os.getenv("AZURE_MAX_QUEUE", "32")),
+    "queue_timeout": float(os.getenv("AZURE_QUEUE_TIMEOUT", "5")),
+}
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed instead of queued. Callers should answer 503."""
+
+    def __init__(self, kind: str, retry_after: int = 5):
+        super().__init__(f"Azure {kind} budget exhausted")
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+class TokenBucket:
+    """Classic token bucket. Not thread-safe on its own; guarded by the owning lane's lock."""
+
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate = rate_per_sec
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def try_take(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Lane:
+    """Admission state for one deployment: rate bucket, AIMD concurrency limit and wait queue."""
+
+    MIN_CONCURRENCY = 1.0
+    DECREASE_COOLDOWN = 1.0  # One multiplicative decrease per burst of bad signals
+
+    def __init__(self, kind: str, cfg: Dict[str, Any]):
+        self.kind = kind
+        self.cond = threading.Condition()
+        self.bucket = TokenBucket(cfg["rate_per_sec"], cfg["burst"])
+        self.limit = float(cfg["initial_concurrency"])
+        self.max_limit = float(cfg["max_concurrency"])
+        self.latency_target = cfg["latency_target"]
+        self.in_use = 0
+        self.waiting = 0
+        self._last_decrease = 0.0
+
+        self.admitted = 0
+        self.shed = 0
+        self.throttled = 0
+
+    def acquire(self, max_queue: int, queue_timeout: Optional[float]):
+        with self.cond:
+            if max_queue is not None and self.waiting >= max_queue:
+                self.shed += 1
+                raise Overloaded(self.kind)
+
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + queue_timeout if queue_timeout is not None else None
+                while True:
+                    wait_for = None
+                    if self.in_use < int(self.limit):
+                        wait_for = self.bucket.try_take()
+                        if wait_for == 0:
+                            break
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.shed += 1
+                            raise Overloaded(self.kind)
+                        wait_for = remaining if wait_for is None else min(wait_for, remaining)
+                    self.cond.wait(wait_for)
+                self.in_use += 1
+                self.admitted += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self, latency: float, rate_limited: bool):
+        with self.cond:
+            self.in_use -= 1
+            now = time.monotonic()
+            if rate_limited or latency > self.latency_target:
+                if rate_limited:
+                    self.throttled += 1
+                if now - self._last_decrease >= self.DECREASE_COOLDOWN:
+                    factor = 0.5 if rate_limited else 0.9
+                    self.limit = max(self.MIN_CONCURRENCY, self.limit * factor)
+                    self._last_decrease = now
+            else:
+                # Additive increase: roughly +1 per "window" of successful calls
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "limit": round(self.limit, 2),
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "throttled_429": self.throttled,
+            }
+
+
+class AdmissionController:
+    """
+    Shared gate in front of every Azure call (thread-safe; classifier code runs in worker threads).
+
+    Usage:
+        with ADMISSION.slot("embed"):
+            resp = client.embeddings.create(...)
+
+    Request-path calls are sheddable: if too many callers are already queued,
+    or the wait exceeds queue_timeout, Overloaded is raised immediately.
+    Index builds pass sheddable=False and simply wait their turn.
+
+    Each deployment also has a circuit breaker: while it is open, slot()
+    raises CircuitOpen before queueing, so callers can take a local fallback.
+    """
+
+    def __init__(self, config: Dict[str, Any], breaker_config: Dict[str, Any]):
+        self.max_queue = config["max_queue"]
+        self.queue_timeout = config["queue_timeout"]
+        self.lanes = {kind: _Lane(kind, config[kind]) for kind in ("embed", "chat")}
+        self.breakers = {kind: CircuitBreaker(kind, **breaker_config) for kind in self.lanes}
+
+    @contextmanager
+    def slot(self, kind: str, sheddable: bool = True, timeout: Optional[float] = None):
+        """
+        `timeout` is the client timeout the call was given (None = SDK default).
+        A timeout shorter than the lane's latency target was cut short by the
+        caller's own deadline; it is not held against the deployment.
+        """
+        lane = self.lanes[kind]
+        breaker = self.breakers[kind]
+        breaker.before_call()
+        try:
+            if sheddable:
+                lane.acquire(self.max_queue, self.queue_timeout)
+            else:
+                lane.acquire(None, None)
+        except Overloaded:
+            breaker.release_probe()
+            raise
+
+        start = time.monotonic()
+        rate_limited = False
+        try:
+            yield
+        except Exception as e:
+            rate_limited = is_rate_limited(e)
+            if timeout is not None and timeout < lane.latency_target and is_timeout(e):
+                breaker.release_probe()
+            else:
+                breaker.on_failure(e)
+            raise
+        else:
+            breaker.on_success()
+        finally:
+            lane.release(time.monotonic() - start, rate_limited)
+
+    def stats(self) -> Dict[str, Any]:
+        return {kind: lane.stats() for kind, lane in self.lanes.items()}
+
+    def breaker_stats(self) -> Dict[str, Any]:
+        return {kind: breaker.stats() for kind, breaker in self.breakers.items()}
+
+
+ADMISSION = AdmissionController(ADMISSION_CONFIG, BREAKER_CONFIG)
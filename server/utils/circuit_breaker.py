@@ -0,0 +1,110 @@
+import logging
+import os
+import time
+import threading
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+BREAKER_CONFIG = {
+    "failure_threshold": int(os.getenv("AZURE_BREAKER_FAILURES", "5")),
+    "recovery_timeout": float(os.getenv("AZURE_BREAKER_RECOVERY_SECONDS", "30")),
+}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a deployment whose breaker is open."""
+
+    def __init__(self, name: str):
+        super().__init__(f"Azure {name} circuit is open")
+        self.name = name
+
+
+def is_timeout(error: Exception) -> bool:
+    # openai.APITimeoutError / httpx timeouts, without importing either here
+    return isinstance(error, TimeoutError) or "Timeout" in type(error).__name__
+
+
+def counts_as_outage(error: Exception) -> bool:
+    """Timeouts, connection errors, 429 and 5xx trip the breaker; other 4xx are caller bugs."""
+    status = getattr(error, "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker for one deployment.
+
+    closed    -> calls pass; `failure_threshold` consecutive failures open it
+    open      -> calls fail fast with CircuitOpen for `recovery_timeout` seconds
+    half_open -> a single probe call is let through; success closes, failure re-opens
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+        self.rejected = 0
+        self.times_opened = 0
+
+    def before_call(self):
+        """Raises CircuitOpen unless the call may proceed."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name)
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name)
+                self._probe_in_flight = True
+
+    def release_probe(self):
+        """The admitted call never reached Azure (e.g. it was shed); let another probe through."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def on_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                logger.info("Circuit '%s' closed after successful probe.", self.name)
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def on_failure(self, error: Exception):
+        with self._lock:
+            if not counts_as_outage(error):
+                # The deployment answered; do not hold a half-open probe hostage
+                self._probe_in_flight = False
+                return
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning("Circuit '%s' opened after %d failures.", self.name, self.consecutive_failures)
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,171 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Optional, Set, TypeVar, Dict, Any
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before this stage finished."""
+
+
+class Deadline:
+    """
+    Time budget for one request, passed down through every stage.
+    Also records which stages had to fall back to vector-only ranking, and the
+    rerank's calibrated confidence per stage when it produced one.
+    """
+
+    def __init__(self, seconds: Optional[float] = None, degraded: Optional[Set[str]] = None,
+                 confidence: Optional[Dict[str, float]] = None):
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+        self.degraded: Set[str] = degraded if degraded is not None else set()
+        self.confidence: Dict[str, float] = confidence if confidence is not None else {}
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self) -> Optional[float]:
+        """Remaining time as an HTTP client timeout (None = unlimited)."""
+        return None if self.expires_at is None else self.remaining()
+
+    def sub(self, fraction: float) -> "Deadline":
+        """A tighter deadline for one stage, leaving the rest of the budget for later stages."""
+        if self.expires_at is None:
+            return self
+        return Deadline(self.remaining() * fraction, self.degraded, self.confidence)
+
+    def mark_unreranked(self, stage: str):
+        self.degraded.add(stage)
+
+    def record_confidence(self, stage: str, probability: float):
+        self.confidence[stage] = probability
+
+
+class LatencyTracker:
+    """Rolling window of call latencies; p95 decides when to hedge."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20, default_p95: float = 4.0, floor: float = 0.5):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.min_samples = min_samples
+        self.default_p95 = default_p95
+        self.floor = floor
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self) -> float:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.default_p95
+            ordered = sorted(self._samples)
+        return max(self.floor, ordered[int(0.95 * (len(ordered) - 1))])
+
+
+# Chat latency is what drives the hedge delay; embeddings are not hedged
+CHAT_LATENCY = LatencyTracker()
+
+HEDGE_STATS = {"calls": 0, "hedged": 0, "hedge_wins": 0, "deadline_expired": 0, "inline": 0, "cancelled": 0}
+
+_HEDGE_WORKERS = 16
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=_HEDGE_WORKERS, thread_name_prefix="hedge")
+# Work is only submitted while a worker is free, so nothing ever waits in the pool's
+# (unbounded) queue in front of the admission controller
+_HEDGE_SLOTS = threading.BoundedSemaphore(_HEDGE_WORKERS)
+
+# Below this much remaining budget a rerank is not worth starting
+MIN_CALL_SECONDS = 0.5
+
+
+def _try_submit(fn: Callable[[], T]) -> Optional[Future]:
+    """Runs fn on a free pool worker, or returns None if all workers are busy."""
+    if not _HEDGE_SLOTS.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            return fn()
+        finally:
+            _HEDGE_SLOTS.release()
+
+    try:
+        # Copy the caller's context so logs from the attempt keep the request ID
+        return _HEDGE_POOL.submit(contextvars.copy_context().run, run)
+    except BaseException:
+        _HEDGE_SLOTS.release()
+        raise
+
+
+def hedged_call(fn: Callable[[Optional[float]], T], deadline: Deadline, tracker: LatencyTracker = CHAT_LATENCY) -> T:
+    """
+    Runs fn(timeout) and, if it has not answered within the tracker's p95,
+    starts one duplicate and returns whichever succeeds first.
+    Raises DeadlineExceeded if neither answers within the deadline; if both
+    fail, the first error is re-raised.
+
+    When every pool worker is busy the call runs unhedged on the calling thread.
+    Attempts that have not started when the call returns are cancelled, and an
+    attempt that starts with less than MIN_CALL_SECONDS left gives up without
+    calling fn.
+    """
+    if deadline.remaining() < MIN_CALL_SECONDS:
+        HEDGE_STATS["deadline_expired"] += 1
+        raise DeadlineExceeded()
+    HEDGE_STATS["calls"] += 1
+
+    def attempt():
+        # Re-checked here: the attempt may start well after it was submitted
+        if deadline.remaining() < MIN_CALL_SECONDS:
+            raise DeadlineExceeded()
+        start = time.monotonic()
+        result = fn(deadline.timeout())
+        tracker.record(time.monotonic() - start)
+        return result
+
+    primary = _try_submit(attempt)
+    if primary is None:
+        # Saturated: hedging now would only add load
+        HEDGE_STATS["inline"] += 1
+        return attempt()
+
+    futures = [primary]
+    try:
+        done, _ = wait(futures, timeout=min(tracker.p95(), deadline.remaining()))
+        if not done and deadline.remaining() >= MIN_CALL_SECONDS:
+            hedge = _try_submit(attempt)
+            if hedge is not None:
+                HEDGE_STATS["hedged"] += 1
+                futures.append(hedge)
+
+        errors = []
+        pending = set(futures)
+        while pending:
+            remaining = deadline.remaining()
+            done, pending = wait(pending, timeout=remaining if remaining != float("inf") else None, return_when=FIRST_COMPLETED)
+            if not done:
+                HEDGE_STATS["deadline_expired"] += 1
+                raise DeadlineExceeded()
+            for f in done:
+                if f.exception() is None:
+                    if f is not primary:
+                        HEDGE_STATS["hedge_wins"] += 1
+                    return f.result()
+                errors.append(f.exception())
+        raise errors[0]
+    finally:
+        # Running attempts finish on their own (their timeout ends with the deadline);
+        # ones still queued never start
+        for f in futures:
+            if f.cancel():
+                HEDGE_STATS["cancelled"] += 1
+
+
+def hedge_stats() -> Dict[str, Any]:
+    return {**HEDGE_STATS, "chat_p95_seconds": round(CHAT_LATENCY.p95(), 3)}
@@ -1,27 +1,89 @@
 import traceback
 import logging
-from typing import Union
+import logging.handlers
+import atexit
+import contextvars
+import json
+import queue
+import uuid
+from typing import Union, Optional
 
 import os
 
+# Set per HTTP request by the middleware in main.py; asyncio.to_thread copies it
+# into the worker thread, so classifier logs carry the ID of the request they serve.
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def _is_header_dump(record: logging.LogRecord) -> bool:
+    # Checks the unformatted template only; formatting every record just to filter it is wasteful
+    msg = record.msg
+    return isinstance(msg, str) and ("Response headers:" in msg or "Request headers:" in msg)
+
 
 class DebugFilter(logging.Filter):
     def filter(self, record):
-        message = record.getMessage()
-        request_details = ("Response headers:" in message) or (
-            "Request headers:" in message
-        )
         debug_message = record.levelno == logging.DEBUG
-        return request_details or debug_message
+        return _is_header_dump(record) or debug_message
 
 
 class InfoFilter(logging.Filter):
     def filter(self, record):
-        message = record.getMessage()
-        request_details = ("Response headers:" in message) or (
-            "Request headers:" in message
-        )
-        return not request_details
+        return not _is_header_dump(record)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps the current request ID onto the record. Runs on the calling thread, where the ID is set."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get() or "-"
+        return True
+
+
+# Attributes every LogRecord has; anything else was passed via `extra=` and goes into the JSON
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "stack"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, request_id, msg, plus any `extra=` fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that does not format on the caller's thread.
+
+    The stock prepare() merges msg % args before enqueueing; here the record is
+    enqueued as-is and the listener thread does all formatting, so pass values
+    (not objects that change afterwards) as args. Only exception tracebacks are
+    rendered up front, since they reference live frames.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
 
 
 logger: Union[None, logging.Logger] = None
@@ -58,20 +120,29 @@ debug_handler.setLevel(logging.DEBUG)  # Set this handler's level to DEBUG
 # Add the filter to the debug handler
 debug_handler.addFilter(DebugFilter())
 
-# You can set different formats for the handlers if needed
-formatter = logging.Formatter(
-    fmt="%(asctime)s %(levelname)-8s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+# Log files are structured JSON; the console stays human-readable unless LOG_FORMAT=json
+json_formatter = JsonFormatter()
+text_formatter = logging.Formatter(
+    fmt="%(asctime)s %(levelname)-8s [%(request_id)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
 )
 
-# Apply the formatter to both handlers
-info_handler.setFormatter(formatter)
-debug_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+info_handler.setFormatter(json_formatter)
+debug_handler.setFormatter(json_formatter)
+console_handler.setFormatter(json_formatter if os.getenv("LOG_FORMAT") == "json" else text_formatter)
 
-# Add handlers to the logger
-logger.addHandler(info_handler)
-logger.addHandler(debug_handler)
-logger.addHandler(console_handler)
+# The root logger only enqueues; file and console I/O happen on the listener thread,
+# so a slow disk or stdout pipe never blocks a request.
+log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+queue_handler = LazyQueueHandler(log_queue)
+queue_handler.addFilter(RequestIdFilter())
+logger.addHandler(queue_handler)
+
+listener = logging.handlers.QueueListener(
+    log_queue, info_handler, debug_handler, console_handler, respect_handler_level=True
+)
+listener.start()
+# Flush what is still queued on shutdown
+atexit.register(listener.stop)
 
 
 def log_msg(msg: Union[str, Exception]) -> None:
@@ -0,0 +1,83 @@
+import gzip
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    # Optional: brotli is noticeably smaller for the tree, but gzip alone is fine
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as required for If-None-Match (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+def accepted_encodings(header: Optional[str]) -> Dict[str, float]:
+    """Parses Accept-Encoding into {coding: q}. A coding with q=0 is explicitly refused."""
+    accepted: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class PrecompressedJSON:
+    """
+    A JSON document serialized and compressed once, then served as-is.
+
+    Every variant carries the same weak ETag (the content only differs by
+    encoding), so clients revalidate with If-None-Match and get a bodyless 304.
+    """
+
+    def __init__(self, data: Any, etag: str):
+        self.etag = f'W/"{etag}"'
+        self.identity = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.encoded: Dict[str, bytes] = {"gzip": gzip.compress(self.identity, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(self.identity, quality=11)
+
+    def sizes(self) -> Dict[str, int]:
+        return {"identity": len(self.identity), **{k: len(v) for k, v in self.encoded.items()}}
+
+    def response(self, request: Request) -> Response:
+        headers = {
+            "ETag": self.etag,
+            "Vary": "Accept-Encoding",
+            # Always revalidate; the 304 is cheap and a taxonomy reload changes the ETag
+            "Cache-Control": "no-cache",
+        }
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=headers)
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        # Highest q wins; on a tie br is preferred (smaller). "*" covers codings not listed.
+        best, best_q = None, 0.0
+        for encoding in ("br", "gzip"):
+            q = accepted.get(encoding, accepted.get("*", 0.0))
+            if encoding in self.encoded and q > best_q:
+                best, best_q = encoding, q
+        if best is not None:
+            headers["Content-Encoding"] = best
+            return Response(self.encoded[best], media_type="application/json", headers=headers)
+        return Response(self.identity, media_type="application/json", headers=headers)
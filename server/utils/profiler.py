@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import cProfile
+import pstats
+import tempfile
+import threading
+import tracemalloc
+import logging
+from collections import Counter
+from typing import Callable, Dict, Any, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded(counts: Counter) -> bytes:
+    """Collapsed-stack format ("root;child;leaf count" per line), read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common()).encode("utf-8")
+
+
+class _StackSampler(threading.Thread):
+    """Samples the stacks of the registered threads every `interval` seconds."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.interval = interval
+        self.threads: set = set()
+        self.counts: Counter = Counter()
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                for ident in self.threads:
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    if stack:
+                        self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Profiler:
+    """
+    On-demand profiling for the admin endpoints. Nothing is installed until armed:
+    while idle, the request path pays one attribute check.
+
+    CPU capture covers the next N analyses, in one of two modes:
+      sample   - wall-clock stack samples of the analysis threads -> collapsed stacks (.folded)
+      cprofile - deterministic cProfile of each analysis (one at a time), merged -> pstats file (.prof)
+
+    Allocation capture runs tracemalloc around the next taxonomy index build and
+    reports the memory still held afterwards as byte-weighted collapsed stacks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cpu_armed = False
+        self.alloc_armed = False
+
+        self._mode = "sample"
+        self._remaining = 0
+        self._running = 0
+        self._captured = 0
+        self._sampler: Optional[_StackSampler] = None
+        self._stats: Optional[pstats.Stats] = None
+        self._started_at = 0.0
+
+        # kind -> (filename, payload bytes, media type)
+        self.results: Dict[str, Tuple[str, bytes, str]] = {}
+        self.alloc_summary: Optional[Dict[str, Any]] = None
+
+    # --- CPU ---
+
+    def arm_cpu(self, requests: int, mode: str = "sample", interval: float = 0.005) -> bool:
+        """Profiles the next `requests` analyses. Returns False if a capture is already running."""
+        with self._lock:
+            if self.cpu_armed or self._running:
+                return False
+            self._mode = mode
+            self._remaining = requests
+            self._captured = 0
+            self._stats = None
+            self._started_at = time.time()
+            if mode == "sample":
+                self._sampler = _StackSampler(interval)
+                self._sampler.start()
+            self.cpu_armed = True
+        logger.info("CPU profiling armed for %d requests (%s).", requests, mode)
+        return True
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if not self.cpu_armed or self._remaining <= 0:
+                return False
+            # Only one cProfile can be active per process (3.12+); overlapping requests run unprofiled
+            if self._mode == "cprofile" and self._running:
+                return False
+            self._remaining -= 1
+            self._running += 1
+            if self._remaining == 0:
+                self.cpu_armed = False
+            return True
+
+    def profile_call(self, fn: Callable[..., T], *args) -> T:
+        """Runs fn(*args) in the current thread, profiled if a CPU capture still needs requests."""
+        if not self._claim():
+            return fn(*args)
+
+        ident = threading.get_ident()
+        profile = None
+        if self._mode == "sample":
+            with self._sampler.lock:
+                self._sampler.threads.add(ident)
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            return fn(*args)
+        finally:
+            if profile is not None:
+                profile.disable()
+            self._finish_call(ident, profile)
+
+    def _finish_call(self, ident: int, profile: Optional[cProfile.Profile]):
+        with self._lock:
+            if profile is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+            elif self._sampler is not None:
+                with self._sampler.lock:
+                    self._sampler.threads.discard(ident)
+            self._running -= 1
+            self._captured += 1
+            done = not self.cpu_armed and self._running == 0
+        if done:
+            self._finalize_cpu()
+
+    def _finalize_cpu(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started_at))
+        if self._mode == "sample":
+            sampler, self._sampler = self._sampler, None
+            sampler.stop()
+            self.results["cpu"] = (f"analyze-{stamp}.folded", _folded(sampler.counts), "text/plain")
+        else:
+            with tempfile.NamedTemporaryFile(suffix=".prof", delete=False) as f:
+                path = f.name
+            try:
+                self._stats.dump_stats(path)
+                with open(path, "rb") as f:
+                    self.results["cpu"] = (f"analyze-{stamp}.prof", f.read(), "application/octet-stream")
+            finally:
+                os.remove(path)
+        logger.info("CPU profile of %d requests is ready.", self._captured)
+
+    # --- Allocations ---
+
+    def arm_allocations(self) -> bool:
+        with self._lock:
+            if self.alloc_armed or tracemalloc.is_tracing():
+                return False
+            self.alloc_armed = True
+            return True
+
+    def trace_allocations(self, fn: Callable[..., T], *args) -> T:
+        """Runs fn(*args) (an index build), under tracemalloc if allocation capture is armed."""
+        with self._lock:
+            armed, self.alloc_armed = self.alloc_armed, False
+        if not armed:
+            return fn(*args)
+
+        tracemalloc.start(32)
+        start = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            counts: Counter = Counter()
+            for stat in snapshot.statistics("traceback"):
+                # Frames are ordered oldest first, i.e. already root-to-leaf
+                stack = ";".join(f"{os.path.basename(fr.filename)}:{fr.lineno}" for fr in stat.traceback)
+                counts[stack] += stat.size
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            self.results["allocations"] = (f"index-load-{stamp}.folded", _folded(counts), "text/plain")
+            self.alloc_summary = {
+                "retained_bytes": current,
+                "peak_bytes": peak,
+                "seconds": round(time.monotonic() - start, 3),
+            }
+            logger.info("Allocation trace of index load is ready (peak %d bytes).", peak)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cpu": {
+                    "armed": self.cpu_armed,
+                    "mode": self._mode,
+                    "remaining": self._remaining,
+                    "in_progress": self._running,
+                    "captured": self._captured,
+                },
+                "allocations": {"armed": self.alloc_armed, "last": self.alloc_summary},
+                "results": {kind: {"filename": r[0], "bytes": len(r[1])} for kind, r in self.results.items()},
+            }
+
+
+PROFILER = Profiler()